@@ -1,2 +1,12 @@
-from .generator import TskError, Generator
-from .admin import create_app
+__version__ = '0.1.7'
+
+from .utils import TskError
+from .generator import Generator
+
+def create_app(*args, **kwargs):
+    """
+    the admin app, see `tsk.admin`. flask is only imported once it's asked
+    for, builds don't pay for it.
+    """
+    from .admin import create_app
+    return create_app(*args, **kwargs)
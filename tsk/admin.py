@@ -1,27 +1,222 @@
 # coding=utf-8
 import os
+import hashlib
+import threading
+import collections
 import flask
 
+from .utils import file_stat
+
 """
 TODO:
 -----
 Authentication # works with cookies
 - login
 - logout
-
-Pages
-- listing
-- edit
-- delete
-- add
 """
 
+class Preview(object):
+    """
+    pages of the book rendered on request by a long-lived `generator`,
+    with no build involved: the book comes from the `catalog` of the meta
+    blocks of the sources, then the page asked for is preprocessed, 
+    rendered and put in its layout.
+
+    the last `size` pages rendered are kept, each for as long as the files
+    it was made of (source, files read by its commands, templates, toc)
+    keep their size and mtime and the book keeps the same pages.
+    """
+
+    def __init__(self, generator, catalog, size=200):
+        self.generator = generator
+        # where the book comes from
+        self.catalog = catalog
+        self.size = size
+        # url: {'etag', 'html', 'files': [(path, stat)], 'book'}
+        self.pages = collections.OrderedDict()
+        # files the toc and navigation are made of, and their state
+        self._toc_files = []
+        self._toc_state = None
+        # the generator renders one page at a time
+        self._lock = threading.Lock()
+
+    def render(self, url):
+        """
+        (etag, html) of the page at `url`, None if the book has no such
+        page.
+        """
+        with self._lock:
+            g = self.generator
+            self.catalog.sync()
+            g.book = self.catalog.book()
+            if url not in g.book and self.catalog.sync(force=True):
+                # e.g. a page just added
+                g.book = self.catalog.book()
+            if url not in g.book:
+                return None
+            signature = g._book_signature()
+            self._refresh_toc(signature)
+            entry = self.pages.pop(url, None)
+            if (entry is None or entry['book']!=signature or
+                any(file_stat(p)!=stat for p, stat in entry['files'])):
+                entry = self._render(g.book[url])
+                entry['book'] = signature
+            self.pages[url] = entry
+            while len(self.pages) > self.size:
+                self.pages.popitem(last=False)
+            return entry['etag'], entry['html']
+
+    def _refresh_toc(self, signature):
+        """
+        load the toc again when it, the navigation or the pages it links to
+        changed.
+        """
+        g = self.generator
+        if not g.TOC_FILE:
+            return
+        state = signature, [file_stat(p) for p in self._toc_files]
+        if state==self._toc_state:
+            return
+        g._toc = {}
+        g._template_deps = {}
+        files = [os.path.abspath(os.path.join(g.MARKDOWN_PATH, g.TOC_FILE))]
+        if g.NAV_TEMPLATE:
+            files.extend(sorted(g._template_dependencies(g.NAV_TEMPLATE)[0]))
+        self._toc_files = files
+        self._toc_state = signature, [file_stat(p) for p in files]
+
+    def _render(self, page):
+        g = self.generator
+        # partials and templates may have changed since the last page
+        g._partials = {}
+        g._template_deps = {}
+        filename = os.path.join(g.MARKDOWN_PATH, page['input_file'])
+        with open(filename, 'r') as f:
+            meta, contents = g.preprocess_markdown(f)
+        contents = g.render_markdown(contents)
+        meta.update((k, page[k])
+                    for k in ('input_file', 'output_file', 'output_path'))
+        template = g._page_template(meta)
+        data = meta
+        if g.toc:
+            data = dict(meta, **g._navigation_data(meta))
+        html = g.render_jinja_template(
+            contents_template=g.jinja_environ.from_string(contents),
+            template=template, data=data, toc=g.toc)
+        if isinstance(html, unicode):
+            html = html.encode('utf8')
+        files = set(g._template_dependencies(template)[0])
+        files |= g._source_dependencies(contents)[0]
+        files.add(os.path.abspath(filename))
+        files.update(meta.get('dependencies', []))
+        files.update(self._toc_files)
+        return {'etag': hashlib.sha1(html).hexdigest(), 'html': html,
+                'files': [(p, file_stat(p)) for p in sorted(files)]}
+
+
+def _catalog_path(generator):
+    return generator.CATALOG_FILE or os.path.join(
+        os.path.dirname(generator._manifest_path()), '.tsk-catalog.sqlite')
+
+def _source_path(generator, name):
+    """
+    path of markdown source `name`, a file name of MARKDOWN_PATH.
+    """
+    if (os.path.basename(name)!=name or not name.endswith('.md') 
+            or name.startswith('.') or name==generator.TOC_FILE):
+        flask.abort(400)
+    return os.path.join(generator.MARKDOWN_PATH, name)
+
 def create_app(import_module, *a, **kw):
+    """
+    given a `generator` keyword, the app previews the pages of its book,
+    e.g. /chapter-1.html, serves the other files of WEB_PAGES_PATH and 
+    manages the markdown sources:
+
+        GET    /admin/pages?title=...&sort=-title&page=2&per_page=50
+        GET    /admin/pages/<input file>
+        PUT    /admin/pages/<input file>    the markdown as request body
+        DELETE /admin/pages/<input file>
+
+    the listing is filtered by any other parameter, a column of the catalog
+    or a meta key, and sorted on either, descending with a leading `-`.
+    """
+    generator = kw.pop('generator', None)
     app = flask.Flask(import_module, *a, **kw)
-    return app
+    if generator is None:
+        return app
+    from .catalog import Catalog
+    catalog = Catalog(generator, _catalog_path(generator))
+    preview = Preview(generator, catalog, generator.PREVIEW_CACHE_SIZE)
+    app.extensions['tsk_preview'] = preview
 
-def list_md_files(mdpath):
-    for f in os.listdir(mdpath):
-        pass
+    @app.route('/', defaults={'url': 'index.html'})
+    @app.route('/<path:url>')
+    def page(url):
+        rendered = preview.render(url)
+        if rendered is None:
+            return flask.send_from_directory(
+                os.path.abspath(generator.WEB_PAGES_PATH), url)
+        etag, html = rendered
+        response = flask.Response(html, mimetype='text/html')
+        response.set_etag(etag)
+        # browsers check with the etag before using their copy
+        response.cache_control.no_cache = True
+        return response.make_conditional(flask.request)
 
+    @app.route('/admin/pages')
+    def list_pages():
+        args = flask.request.args
+        try:
+            number = max(1, int(args.get('page', 1)))
+            per_page = min(500, max(1, int(args.get('per_page', 50))))
+        except ValueError:
+            flask.abort(400)
+        sort = args.get('sort', 'input_file')
+        filters = {}
+        for key, value in args.iteritems():
+            if key in ('page', 'per_page', 'sort'):
+                continue
+            try:
+                # as meta values are read
+                value = int(value)
+            except ValueError:
+                pass
+            filters[key] = value
+        catalog.sync()
+        total, pages = catalog.query(filters, sort.lstrip('-'), 
+                                     sort.startswith('-'), 
+                                     (number - 1) * per_page, per_page)
+        return flask.jsonify(total=total, page=number, per_page=per_page,
+                             pages=pages)
 
+    @app.route('/admin/pages/<name>')
+    def get_source(name):
+        path = _source_path(generator, name)
+        catalog.refresh([path])
+        total, pages = catalog.query({'input_file': name}, limit=1)
+        if not pages:
+            flask.abort(404)
+        with open(path, 'r') as f:
+            pages[0]['source'] = f.read().decode('utf8')
+        return flask.jsonify(pages[0])
+
+    @app.route('/admin/pages/<name>', methods=['PUT'])
+    def put_source(name):
+        path = _source_path(generator, name)
+        created = not os.path.exists(path)
+        generator.write_output(path, flask.request.get_data())
+        catalog.refresh([path])
+        total, pages = catalog.query({'input_file': name}, limit=1)
+        return flask.jsonify(pages[0]), 201 if created else 200
+
+    @app.route('/admin/pages/<name>', methods=['DELETE'])
+    def delete_source(name):
+        path = _source_path(generator, name)
+        if not os.path.isfile(path):
+            flask.abort(404)
+        os.remove(path)
+        catalog.refresh([path])
+        return '', 204
+
+    return app
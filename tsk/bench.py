@@ -0,0 +1,410 @@
+# coding=utf8
+"""
+benchmarks for the generator.
+
+    python -m tsk.bench                          # run the suite
+    python -m tsk.bench --save baseline.json     # and keep it as baseline
+    python -m tsk.bench --compare baseline.json  # flag slowdowns
+    python -m tsk.bench --micro                  # converter, preprocess, nav
+    python -m tsk.bench --startup                # imports, no-change build
+
+the suite builds a synthetic book, see `synthetic_book` for its knobs, and
+times each stage on it. a baseline is only comparable with results from a
+book of the same shape, on the same machine.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import timeit
+import StringIO
+import subprocess
+
+import markdown
+
+from .generator import Generator, tsk_command_anchor, tsk_command_include
+from .toc import TOC
+
+def chapter_text(n, paragraphs=5):
+    """
+    a small markdown chapter.
+    """
+    lines = ['# Chapter {}'.format(n), '']
+    for p in xrange(paragraphs):
+        lines.append('## Section {}.{}'.format(n, p))
+        lines.append('')
+        lines.append('Some *emphasis*, some **strong** text and a '
+                     '[link](http://example.com/{}).'.format(p))
+        lines.append('')
+        lines.append('- item one\n- item two\n- item three')
+        lines.append('')
+    return '\n'.join(lines)
+
+def temp_generator(**config):
+    root = tempfile.mkdtemp()
+    c = dict(MARKDOWN_PATH=root + '/markdown',
+             TEMPLATE_PATH=root + '/templates',
+             DEFAULT_TEMPLATE='main.html',
+             MARKDOWN_OUTPUT_DIR=root + '/templates/pages',
+             WEB_PAGES_PATH=root + '/website')
+    c.update(config)
+    return root, Generator(c)
+
+def bench_markdown_converter(chapters=500, repeat=3):
+    """
+    per chapter cost of rendering with a new converter for each file versus
+    the generator's reused converter.
+    """
+    texts = [chapter_text(i, paragraphs=1).decode('utf8') for i in xrange(chapters)]
+    root, g = temp_generator()
+    try:
+        def fresh():
+            for t in texts:
+                markdown.Markdown(output_format='html5').convert(t)
+        def pooled():
+            for t in texts:
+                g.render_markdown(t)
+        results = {}
+        for name, func in [('fresh', fresh), ('pooled', pooled)]:
+            best = min(timeit.repeat(func, number=1, repeat=repeat))
+            results[name] = best / chapters
+    finally:
+        shutil.rmtree(root)
+    return results
+
+def write_large_chapter(filename, size_mb=50):
+    """
+    a chapter of about `size_mb` MB with meta, comments and commands.
+    """
+    size = size_mb * 1024 * 1024
+    with open(filename, 'w') as f:
+        f.write('---\ntitle: Large chapter\nauthor: tsk\n---\n')
+        n = written = 0
+        while written < size:
+            block = (chapter_text(n) + '\n-#-\na comment\n-#-\n'
+                     '$$ anchor section {}\n'.format(n))
+            f.write(block)
+            written += len(block)
+            n += 1
+
+def _legacy_preprocess(text):
+    # concatenation over a list of lines, as preprocess_markdown used to
+    md = ''
+    for line in StringIO.StringIO(text).readlines():
+        md += line
+    return md
+
+def bench_preprocess(size_mb=50, repeat=1):
+    """
+    preprocess a generated chapter of `size_mb` MB streamed from its file 
+    and from a string, next to the former concatenation loop.
+    """
+    root, g = temp_generator()
+    g.register_command(tsk_command_anchor)
+    filename = os.path.join(root, 'large.md')
+    try:
+        write_large_chapter(filename, size_mb)
+        with open(filename) as f:
+            text = f.read()
+        def from_file():
+            with open(filename) as f:
+                g.preprocess_markdown(f)
+        results = {}
+        for name, func in [('file', from_file), 
+                           ('string', lambda: g.preprocess_markdown(text)),
+                           ('legacy', lambda: _legacy_preprocess(text))]:
+            results[name] = min(timeit.repeat(func, number=1, repeat=repeat))
+    finally:
+        shutil.rmtree(root)
+    return results
+
+def navigation_book(root, pages):
+    """
+    `pages` one paragraph chapters listed in a flat toc, with a layout
+    drawing the toc by walking it and one using the pre-rendered nav.
+    """
+    md = os.path.join(root, 'markdown')
+    templates = os.path.join(root, 'templates')
+    for d in [md, os.path.join(templates, 'pages')]:
+        if not os.path.exists(d):
+            os.makedirs(d)
+    titles = ['Page {}'.format(i) for i in xrange(pages)]
+    for i, title in enumerate(titles):
+        with open(os.path.join(md, 'page-{}.md'.format(i)), 'w') as f:
+            f.write('---\ntitle: {}\n---\nchapter {}\n'.format(title, i))
+    with open(os.path.join(md, 'toc.md'), 'w') as f:
+        f.write('\n'.join(titles))
+    link = '<a href="{{ e.url }}"%s>{{ e.title }}</a>'
+    with open(os.path.join(templates, 'walk.html'), 'w') as f:
+        f.write('{% for e in toc.entries %}' + link % (
+            '{% if e.url==data.output_file %} class="active"{% endif %}') + 
+            '{% endfor %}{% include contents_template %}')
+    with open(os.path.join(templates, 'nav.html'), 'w') as f:
+        f.write('{% for e in toc.entries %}' + link % '{{ active(e) }}' + 
+                '{% endfor %}')
+    with open(os.path.join(templates, 'main.html'), 'w') as f:
+        f.write('{{ data.nav }}{% include contents_template %}')
+
+def bench_navigation(sizes=(500, 1000, 2000, 5000), walk_limit=2000, 
+                     repeat=3):
+    """
+    per page cost of generate_webpages as the book grows, with a layout
+    walking the whole toc and with the pre-rendered nav. outputs aren't
+    written, every page holds the whole nav. walking is only measured up
+    to `walk_limit` pages, it grows with the square of the book.
+    """
+    results = {}
+    for pages in sizes:
+        layouts = [('nav', 'main.html')]
+        if pages <= walk_limit:
+            layouts.append(('walk', 'walk.html'))
+        for name, layout in layouts:
+            root, g = temp_generator(DEFAULT_TEMPLATE=layout, IN_MEMORY=True,
+                                     TOC_FILE='toc.md', NAV_TEMPLATE='nav.html')
+            try:
+                navigation_book(root, pages)
+                g.write_output = lambda file, data: None
+                g.process_markdown()
+                best = min(timeit.repeat(g.generate_webpages, number=1, 
+                                         repeat=repeat))
+            finally:
+                shutil.rmtree(root)
+            results['{} {:>5}'.format(name, pages)] = best / pages
+    return results
+
+# shape of the synthetic book of the suite
+BOOK = dict(chapters=100, paragraphs=10, toc_depth=3, includes=2, 
+            meta_lines=5)
+
+def synthetic_book(root, chapters=100, paragraphs=10, toc_depth=3, 
+                   includes=2, meta_lines=5):
+    """
+    write a book under `root` for a generator configured by `book_config`:
+    `chapters` chapters of `paragraphs` sections each, a meta block of 
+    `meta_lines` lines, `includes` `$$ include` commands per chapter and a
+    toc nesting every section `toc_depth` levels deep (1 to 5).
+    """
+    if not 1 <= toc_depth <= 5:
+        raise ValueError('toc_depth must be between 1 and 5.')
+    md = os.path.join(root, 'markdown')
+    templates = os.path.join(root, 'templates')
+    for d in [os.path.join(md, 'partials'), os.path.join(templates, 'pages'),
+              os.path.join(root, 'website')]:
+        if not os.path.exists(d):
+            os.makedirs(d)
+    partials = ['table-{}.html'.format(i) for i in xrange(min(includes, 10))]
+    for i, name in enumerate(partials):
+        with open(os.path.join(md, 'partials', name), 'w') as f:
+            f.write('<table>' + '<tr><td>{}</td></tr>'.format(i) * 10 + 
+                    '</table>')
+    toc = ['---', 'page_level: 0', '---']
+    for n in xrange(chapters):
+        title = 'Chapter {}'.format(n)
+        body = chapter_text(n, paragraphs).split('\n')
+        for i in reversed(xrange(includes)):
+            # spread along the chapter
+            body.insert(len(body) * (i + 1) // (includes + 1), 
+                        '\n$$ include {}\n'.format(partials[i % 10]))
+        meta = ['title: ' + title] + ['key{0}: value {0}'.format(i) 
+                                      for i in xrange(meta_lines)]
+        with open(os.path.join(md, 'chapter-{}.md'.format(n)), 'w') as f:
+            f.write('\n'.join(['---'] + meta + ['---', ''] + body))
+        toc.append(title)
+        for p in xrange(paragraphs):
+            for level in xrange(1, toc_depth):
+                toc.append('    ' * level + 'Section {}.{}.{}'.format(
+                    n, p, level))
+    with open(os.path.join(md, 'toc.md'), 'w') as f:
+        f.write('\n'.join(toc))
+    with open(os.path.join(templates, 'main.html'), 'w') as f:
+        f.write('<nav>{% for e in toc.children %}<a href="{{ e.url }}">'
+                '{{ e.title }}</a>{% endfor %}</nav>'
+                '<h1>{{ data.title[0] }}</h1>{% include contents_template %}')
+
+def book_config(root):
+    return dict(MARKDOWN_PATH=os.path.join(root, 'markdown'),
+                TEMPLATE_PATH=os.path.join(root, 'templates'),
+                DEFAULT_TEMPLATE='main.html',
+                MARKDOWN_OUTPUT_DIR=os.path.join(root, 'templates', 'pages'),
+                WEB_PAGES_PATH=os.path.join(root, 'website'),
+                TOC_FILE='toc.md')
+
+def book_generator(root):
+    g = Generator(book_config(root))
+    g.register_command(tsk_command_include)
+    return g
+
+def _best(func, repeat, setup=None):
+    best = None
+    for i in xrange(repeat):
+        if setup:
+            setup()
+        start = time.time()
+        func()
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def bench_suite(repeat=3, **book):
+    """
+    best time in seconds of each stage over the whole synthetic book: 
+    `preprocess_markdown`, `render_markdown`, `TOC.generate`, 
+    `generate_webpages` and a full build from an empty output.
+    """
+    book = dict(BOOK, **book)
+    root = tempfile.mkdtemp()
+    try:
+        synthetic_book(root, **book)
+        g = book_generator(root)
+        sources = sorted(g.traverse_markdown_dir())
+        texts = []
+        for filename in sources:
+            with open(filename) as f:
+                texts.append(f.read())
+        converted = [g.preprocess_markdown(t)[1] for t in texts]
+        g.process_markdown()
+        toc_file = os.path.join(root, 'markdown', 'toc.md')
+        pages = set(g.book)
+        website = os.path.join(root, 'website')
+        def clean():
+            shutil.rmtree(website)
+            os.makedirs(website)
+        def build():
+            book_generator(root).build()
+        results = {
+            'preprocess': _best(
+                lambda: [g.preprocess_markdown(t) for t in texts], repeat),
+            'render': _best(
+                lambda: [g.render_markdown(t) for t in converted], repeat),
+            'toc': _best(
+                lambda: TOC(toc_file, g.MARKDOWN_OUTPUT_DIR, pages).generate(),
+                repeat),
+            'webpages': _best(g.generate_webpages, repeat, clean),
+            'build': _best(build, repeat, clean),
+        }
+    finally:
+        shutil.rmtree(root)
+    return results
+
+def save_baseline(path, results, book):
+    with open(path, 'w') as f:
+        json.dump({'book': book, 'results': results}, f, indent=1, 
+                  sort_keys=True)
+
+def load_baseline(path):
+    with open(path) as f:
+        return json.load(f)
+
+def compare(baseline, results, threshold=0.1):
+    """
+    benchmarks of `results` slower than in `baseline` by more than 
+    `threshold` (a ratio), as (name, baseline, result) tuples.
+    """
+    slower = []
+    for name in sorted(results):
+        before = baseline.get(name)
+        if before and results[name] > before * (1 + threshold):
+            slower.append((name, before, results[name]))
+    return slower
+
+def _run(*args, **kwargs):
+    subprocess.check_call((sys.executable,) + args, **kwargs)
+
+def bench_startup(chapters=100, repeat=5):
+    """
+    wall time of fresh processes: the interpreter alone, importing tsk and 
+    an INCREMENTAL build of a synthetic book of `chapters` where nothing 
+    changed.
+    """
+    root = tempfile.mkdtemp()
+    try:
+        synthetic_book(root, chapters=chapters, includes=0)
+        config = os.path.join(root, 'tskconfig.py')
+        with open(config, 'w') as f:
+            for k, v in sorted(book_config(root).items()):
+                f.write('{} = {!r}\n'.format(k, v))
+            f.write('INCREMENTAL = True\n')
+        build = ('-m', 'tsk.cli', '-c', config, 'build')
+        with open(os.devnull, 'w') as devnull:
+            _run(*build, stdout=devnull)
+            def no_change():
+                _run(*build, stdout=devnull)
+            results = {
+                'python': _best(lambda: _run('-c', 'pass'), repeat),
+                'import tsk': _best(lambda: _run('-c', 'import tsk'), repeat),
+                'no-change build': _best(no_change, repeat),
+            }
+    finally:
+        shutil.rmtree(root)
+    return results
+
+def report(name, results, unit=1e6, suffix='us/file'):
+    sys.stdout.write('{}\n'.format(name))
+    for k in sorted(results):
+        sys.stdout.write('    {:<16} {:10.1f} {}\n'.format(
+            k, results[k] * unit, suffix))
+
+def micro():
+    report('markdown converter', bench_markdown_converter())
+    report('preprocess 50 MB chapter', bench_preprocess(), unit=1, 
+           suffix='s')
+    report('navigation', bench_navigation())
+
+def parser():
+    p = argparse.ArgumentParser(prog='tsk.bench')
+    p.add_argument('--micro', action='store_true',
+                   help='run the micro benchmarks instead of the suite')
+    p.add_argument('--startup', action='store_true',
+                   help='time imports and a no-change build in new processes')
+    p.add_argument('--save', metavar='FILE', 
+                   help='save the results as a baseline')
+    p.add_argument('--compare', metavar='FILE', 
+                   help='flag slowdowns against a saved baseline')
+    p.add_argument('--threshold', type=float, default=0.1,
+                   help='slowdown ratio flagged by --compare')
+    p.add_argument('--repeat', type=int, default=3)
+    for k, v in sorted(BOOK.items()):
+        p.add_argument('--' + k.replace('_', '-'), type=int, default=None,
+                       help='synthetic book shape, default {}'.format(v))
+    return p
+
+def main(argv=None):
+    args = parser().parse_args(argv)
+    if args.micro:
+        micro()
+        return 0
+    if args.startup:
+        report('startup', bench_startup(repeat=args.repeat), unit=1e3, 
+               suffix='ms')
+        return 0
+    book = dict(BOOK)
+    for k in BOOK:
+        if getattr(args, k) is not None:
+            book[k] = getattr(args, k)
+    baseline = None
+    if args.compare:
+        baseline = load_baseline(args.compare)
+        if baseline['book']!=book:
+            sys.stderr.write('tsk.bench: the baseline was run on a different '
+                             'book: {}\n'.format(baseline['book']))
+            return 2
+    results = bench_suite(repeat=args.repeat, **book)
+    report('suite', results, unit=1e3, suffix='ms')
+    if args.save:
+        save_baseline(args.save, results, book)
+    if baseline:
+        slower = compare(baseline['results'], results, args.threshold)
+        for name, before, after in slower:
+            sys.stdout.write('slower: {:<12} {:10.1f} ms -> {:.1f} ms '
+                             '(+{:.0%})\n'.format(name, before * 1e3, 
+                                                  after * 1e3, 
+                                                  after / before - 1))
+        if slower:
+            return 1
+    return 0
+
+if __name__=='__main__':
+    sys.exit(main())
@@ -0,0 +1,75 @@
+# coding=utf8
+"""
+rendering results kept in a single sqlite file, to be carried between
+machines, e.g. restored as a CI artifact: the preprocessed meta and
+rendered html of markdown sources, and the final html of web pages.
+
+entries are keyed by hashes of everything that went into them, contents
+rather than paths or mtimes, so that a fresh checkout elsewhere still hits.
+entries not used by the last `keep` builds are dropped.
+"""
+import json
+import sqlite3
+import hashlib
+
+from . import __version__
+
+
+def cache_key(*parts):
+    """
+    sha1 of `parts` along with the version of tsk.
+    """
+    h = hashlib.sha1(__version__)
+    for part in parts:
+        if isinstance(part, unicode):
+            part = part.encode('utf8')
+        elif not isinstance(part, str):
+            part = json.dumps(part, sort_keys=True, default=unicode)
+        h.update(str(len(part)) + ':' + part)
+    return h.hexdigest()
+
+
+class BuildCache(object):
+
+    def __init__(self, path, keep=5):
+        self.path = path
+        self.keep = keep
+        self.db = sqlite3.connect(path)
+        self.db.execute('CREATE TABLE IF NOT EXISTS entries ('
+                        'key TEXT PRIMARY KEY, value BLOB, build INTEGER)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS entries_build '
+                        'ON entries (build)')
+        self.build = (self.db.execute('SELECT MAX(build) FROM entries')
+                      .fetchone()[0] or 0) + 1
+
+    def get(self, key):
+        """
+        utf8 bytes stored under `key`, None if there aren't any.
+        """
+        row = self.db.execute('SELECT value, build FROM entries WHERE key=?',
+                              (key,)).fetchone()
+        if row is None:
+            return None
+        if row[1]!=self.build:
+            self.db.execute('UPDATE entries SET build=? WHERE key=?',
+                            (self.build, key))
+        return str(row[0])
+
+    def put(self, key, value):
+        if isinstance(value, unicode):
+            value = value.encode('utf8')
+        self.db.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?)',
+                        (key, sqlite3.Binary(value), self.build))
+
+    def commit(self):
+        """
+        drop the entries left unused and save this build's. a generator
+        kept warm carries on with the next build.
+        """
+        self.db.execute('DELETE FROM entries WHERE build<=?',
+                        (self.build - self.keep,))
+        self.db.commit()
+        self.build += 1
+
+    def close(self):
+        self.db.close()
@@ -0,0 +1,83 @@
+# coding=utf8
+import os
+import json
+import collections
+
+from .manifest import _native
+
+class CommandCache(object):
+    """
+    results of memoized commands, least recently used first, keeping at most
+    `size` of them. with a `path`, entries are loaded from and saved to that
+    file to be reused by later builds.
+
+    an entry holds the result of a command and the state (size, mtime) of
+    the files it was made from. it is only returned while these still match.
+    """
+
+    VERSION = 1
+
+    def __init__(self, path=None, size=1000):
+        self.path = path
+        self.size = size
+        self.entries = collections.OrderedDict()
+        # entries set since the last call to `take_added`, when not None.
+        # used by pool workers to hand new entries back.
+        self.added = None
+        if path:
+            self.load()
+
+    def load(self):
+        try:
+            with open(self.path, 'r') as f:
+                data = _native(json.load(f))
+        except (IOError, ValueError):
+            return
+        if data.get('version')!=self.VERSION:
+            return
+        for key, entry in data.get('entries', []):
+            self.entries[key] = entry
+        self._evict()
+
+    def save(self):
+        if not self.path:
+            return
+        data = dict(version=self.VERSION, entries=self.entries.items())
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(data, f)
+        os.rename(tmp, self.path)
+
+    def get(self, key, states):
+        """
+        the [result, files] entry stored under `key` if the files it was
+        made from are still in the state given by `states(paths)`, else 
+        None.
+        """
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return None
+        result, files = entry
+        if states([p for p, state in files])!=[state for p, state in files]:
+            return None
+        self.entries[key] = entry
+        return entry
+
+    def set(self, key, result, files):
+        """
+        store `result` with `files`, a list of (path, state) pairs.
+        """
+        entry = [result, files]
+        self.entries.pop(key, None)
+        self.entries[key] = entry
+        if self.added is not None:
+            self.added[key] = entry
+        self._evict()
+
+    def take_added(self):
+        added, self.added = self.added, {}
+        return added
+
+    def _evict(self):
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
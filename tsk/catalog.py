@@ -0,0 +1,214 @@
+# coding=utf8
+"""
+catalog of the front matter of the markdown sources in a sqlite file, for
+the admin app to list, filter and sort thousands of pages without reading
+them.
+
+    pages (input_file, output_file, title, template, size, mtime, meta)
+    meta  (input_file, key, value)
+
+`pages` holds a row per source, `meta` a row per value of its meta block,
+both indexed for the lookups the listing does. the catalog follows the
+sources incrementally: `sync` reads the meta of the sources whose size or
+mtime changed since the last one, `refresh` those of files known to have
+changed, e.g. after an edit through the admin app.
+"""
+import os
+import json
+import time
+import sqlite3
+import threading
+
+from .manifest import _native
+from .utils import file_stat
+
+
+class Catalog(object):
+    """
+    catalog of the sources of `generator`, whose `read_markdown_meta` reads
+    their meta.
+    """
+
+    VERSION = 1
+    # columns of `pages` that can be filtered and sorted on directly, other
+    # keys are looked up in `meta`
+    COLUMNS = ('input_file', 'output_file', 'title', 'template', 'mtime')
+    # seconds during which the sources aren't looked at again by `sync`
+    SYNC_INTERVAL = 1.0
+
+    def __init__(self, generator, path=':memory:'):
+        self.generator = generator
+        self.path = path
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        # utf8 strings in and out, like the rest of the generator
+        self.db.text_factory = str
+        self._lock = threading.Lock()
+        self._synced = None
+        # {output_file: meta}, until the next change
+        self._book = None
+        self._create()
+
+    def _create(self):
+        version = self.db.execute('PRAGMA user_version').fetchone()[0]
+        if version!=self.VERSION:
+            # written by another version, it's only a cache of the sources
+            self.db.execute('DROP TABLE IF EXISTS pages')
+            self.db.execute('DROP TABLE IF EXISTS meta')
+            self.db.execute('PRAGMA user_version={:d}'.format(self.VERSION))
+        self.db.execute('CREATE TABLE IF NOT EXISTS pages ('
+                        'input_file TEXT PRIMARY KEY, output_file TEXT, '
+                        'title TEXT, template TEXT, size INTEGER, '
+                        'mtime REAL, meta TEXT)')
+        # pages sort on input_file when the column is the same
+        for column in ('output_file', 'title', 'template', 'mtime'):
+            self.db.execute('CREATE INDEX IF NOT EXISTS pages_{0} '
+                            'ON pages ({0}, input_file)'.format(column))
+        # values keep the types of the meta, ints sort as ints
+        self.db.execute('CREATE TABLE IF NOT EXISTS meta ('
+                        'input_file TEXT, key TEXT, value)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS meta_key '
+                        'ON meta (key, value, input_file)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS meta_input_file '
+                        'ON meta (input_file, key)')
+        self.db.commit()
+
+    def sync(self, force=False):
+        """
+        bring the catalog up to date with MARKDOWN_PATH, at most once every
+        SYNC_INTERVAL seconds unless `force` is set. returns the input files
+        added, changed or removed.
+        """
+        now = time.time()
+        if (not force and self._synced is not None
+                and now - self._synced < self.SYNC_INTERVAL):
+            return set()
+        with self._lock:
+            self._synced = now
+            known = dict((row[0], [row[1], row[2]]) for row in self.db.execute(
+                'SELECT input_file, size, mtime FROM pages'))
+            changed = set()
+            for filename in self.generator.traverse_markdown_dir():
+                name = os.path.basename(filename)
+                if self._update(filename, known.pop(name, None)):
+                    changed.add(name)
+            for name in known:
+                self._delete(name)
+                changed.add(name)
+            self._commit(changed)
+        return changed
+
+    def refresh(self, paths):
+        """
+        update the catalog for the files at `paths`, created, modified or
+        deleted. paths outside of MARKDOWN_PATH are left out.
+        """
+        g = self.generator
+        markdown_path = os.path.abspath(g.MARKDOWN_PATH)
+        toc_file = g.TOC_FILE and os.path.join(markdown_path, g.TOC_FILE)
+        changed = set()
+        with self._lock:
+            for path in paths:
+                path = os.path.abspath(path)
+                if (os.path.dirname(path)!=markdown_path
+                        or not path.endswith('.md') or path==toc_file):
+                    continue
+                name = os.path.basename(path)
+                if os.path.isfile(path):
+                    self._update(path, None)
+                else:
+                    self._delete(name)
+                changed.add(name)
+            self._commit(changed)
+        return changed
+
+    def _update(self, filename, recorded):
+        """
+        read the meta of `filename` again unless its size and mtime are
+        still `recorded`. returns whether it was read.
+        """
+        stat = file_stat(filename)
+        if stat is None or stat==recorded:
+            return False
+        g = self.generator
+        meta = g.read_markdown_meta(filename)
+        name = meta['input_file']
+        title = meta.get('title')
+        if isinstance(title, list):
+            title = ' '.join(str(t) for t in title)
+        self.db.execute('INSERT OR REPLACE INTO pages VALUES '
+                        '(?, ?, ?, ?, ?, ?, ?)',
+                        (name, meta['output_file'], title,
+                         g._page_template(meta), stat[0], stat[1],
+                         json.dumps(meta)))
+        self.db.execute('DELETE FROM meta WHERE input_file=?', (name,))
+        self.db.executemany('INSERT INTO meta VALUES (?, ?, ?)', [
+            (name, key, value) for key, values in meta.iteritems()
+            if key not in ('input_file', 'output_file', 'output_path')
+            for value in (values if isinstance(values, list) else [values])])
+        return True
+
+    def _delete(self, name):
+        self.db.execute('DELETE FROM pages WHERE input_file=?', (name,))
+        self.db.execute('DELETE FROM meta WHERE input_file=?', (name,))
+
+    def _commit(self, changed):
+        if changed:
+            self.db.commit()
+            self._book = None
+
+    def book(self):
+        """
+        meta of every source by output file, as a build would fill the
+        generator's book before rendering.
+        """
+        with self._lock:
+            if self._book is None:
+                self._book = dict(
+                    (output_file, _native(json.loads(meta)))
+                    for output_file, meta in self.db.execute(
+                        'SELECT output_file, meta FROM pages'))
+            return self._book
+
+    def query(self, filters=None, sort='input_file', descending=False,
+              offset=0, limit=50):
+        """
+        (total, pages) where `pages` are at most `limit` of the `total`
+        pages matching every key: value of `filters`, from `offset` on in
+        the order of `sort`. keys and `sort` are COLUMNS or meta keys.
+        each page holds the COLUMNS and the whole `meta`.
+        """
+        where = []
+        params = []
+        for key, value in sorted((filters or {}).iteritems()):
+            if key in self.COLUMNS:
+                where.append('{}=?'.format(key))
+            else:
+                where.append('input_file IN (SELECT input_file FROM meta '
+                             'WHERE key=? AND value=?)')
+                params.append(key)
+            params.append(value)
+        where = ' WHERE ' + ' AND '.join(where) if where else ''
+        if sort in self.COLUMNS:
+            order, order_params = sort, []
+        else:
+            order = ('(SELECT MIN(value) FROM meta WHERE '
+                     'meta.input_file=pages.input_file AND key=?)')
+            order_params = [sort]
+        direction = ' DESC' if descending else ''
+        with self._lock:
+            total = self.db.execute('SELECT COUNT(*) FROM pages' + where,
+                                    params).fetchone()[0]
+            rows = self.db.execute(
+                'SELECT {}, meta FROM pages{} ORDER BY {}{}, input_file{} '
+                'LIMIT ? OFFSET ?'.format(', '.join(self.COLUMNS), where,
+                                          order, direction, direction),
+                params + order_params + [limit, offset]).fetchall()
+        pages = []
+        for row in rows:
+            page = dict(zip(self.COLUMNS, row))
+            page['meta'] = _native(json.loads(row[-1]))
+            pages.append(page)
+        return total, pages
+
+    def close(self):
+        self.db.close()
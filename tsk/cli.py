@@ -0,0 +1,140 @@
+# coding=utf8
+"""
+command line interface, installed as `tsk`. settings are read from a 
+python file, every uppercase name in it is passed to the generator.
+
+    tsk -c tskconfig.py build
+    tsk -c tskconfig.py precompile
+    tsk -c tskconfig.py deps templates/main.html
+    tsk -c tskconfig.py watch
+    tsk -c tskconfig.py preview --port 5000
+    tsk bench --compare baseline.json
+
+kept light: the generator and its dependencies are only imported once a
+command needs them.
+"""
+import os
+import sys
+import argparse
+
+from .utils import TskError
+
+def load_config(path):
+    if not os.path.isfile(path):
+        raise TskError('Config file {} not found.'.format(path))
+    namespace = {'__file__': path}
+    execfile(path, namespace)
+    return dict((k, v) for k, v in namespace.iteritems() if k.isupper())
+
+def build(generator, args):
+    profile = None
+    if args.profile:
+        from .instrument import BuildProfile
+        profile = BuildProfile(generator)
+    generator.build(jobs=args.jobs)
+    sys.stdout.write('{written} files written, {skipped} unchanged.\n'.format(
+        **generator.write_stats))
+    if profile:
+        profile.save(args.profile)
+        sys.stdout.write(profile.summary())
+
+def precompile(generator, args):
+    names = generator.precompile_templates()
+    sys.stdout.write('{} templates compiled.\n'.format(len(names)))
+
+def deps(generator, args):
+    if not generator.manifest:
+        raise TskError('Dependencies are only kept with INCREMENTAL builds.')
+    for path in args.paths:
+        for output in sorted(generator.affected_outputs(path)):
+            sys.stdout.write('{}\n'.format(output))
+
+def watch(generator, args):
+    from .watch import Watcher
+    watcher = Watcher(generator, debounce=args.debounce)
+    generator.build(jobs=args.jobs)
+    def report(paths, pages, elapsed):
+        sys.stdout.write('{} page(s) generated in {:.0f} ms\n'.format(
+            len(pages), elapsed * 1000))
+        sys.stdout.flush()
+    def report_error(paths, error):
+        sys.stderr.write('tsk: {}: {}\n'.format(type(error).__name__, error))
+        sys.stderr.flush()
+    if not watcher.use_events:
+        sys.stdout.write('watchdog is not installed, polling for changes. '
+                         'pip install tsk[watch] for filesystem events.\n')
+    sys.stdout.write('Watching for changes, ctrl-c to stop.\n')
+    sys.stdout.flush()
+    try:
+        watcher.run(report, report_error)
+    except KeyboardInterrupt:
+        pass
+
+def preview(generator, args):
+    from .admin import create_app
+    app = create_app('tsk', generator=generator)
+    app.run(host=args.host, port=args.port)
+
+def parser():
+    p = argparse.ArgumentParser(prog='tsk')
+    p.add_argument('-c', '--config', default='tskconfig.py',
+                   help='python file with the generator settings')
+    sub = p.add_subparsers(dest='command')
+
+    b = sub.add_parser('build', help='generate the book')
+    b.add_argument('-j', '--jobs', type=int, default=None,
+                   help='number of processes rendering markdown')
+    b.add_argument('--profile', metavar='FILE', default=None,
+                   help='time the build and write a json report to FILE')
+    b.set_defaults(func=build)
+
+    c = sub.add_parser('precompile', 
+                       help='compile templates into JINJA_CACHE_DIR')
+    c.set_defaults(func=precompile)
+
+    d = sub.add_parser('deps', 
+                       help='list the web pages built from the given files')
+    d.add_argument('paths', nargs='+')
+    d.set_defaults(func=deps)
+
+    w = sub.add_parser('watch', help='build, then rebuild on changes')
+    w.add_argument('-j', '--jobs', type=int, default=None,
+                   help='number of processes for the initial build')
+    w.add_argument('--debounce', type=float, default=None,
+                   help='seconds to wait for more changes before rebuilding')
+    w.set_defaults(func=watch)
+
+    pv = sub.add_parser('preview', 
+                        help='serve pages rendered on request, without a build')
+    pv.add_argument('--host', default='127.0.0.1')
+    pv.add_argument('--port', type=int, default=5000)
+    pv.set_defaults(func=preview)
+
+    bn = sub.add_parser('bench', help='run the benchmarks, see tsk.bench',
+                        add_help=False)
+    bn.add_argument('args', nargs=argparse.REMAINDER,
+                    help='arguments of python -m tsk.bench')
+    bn.set_defaults(func=None)
+    return p
+
+def main(argv=None):
+    p = parser()
+    # options of the benchmarks aren't known here
+    args, rest = p.parse_known_args(argv)
+    if args.command=='bench':
+        # no config involved, benchmarks make their own books
+        from .bench import main as bench
+        return bench(rest + args.args)
+    if rest:
+        p.error('unrecognized arguments: {}'.format(' '.join(rest)))
+    from .generator import Generator
+    try:
+        generator = Generator(load_config(args.config))
+        args.func(generator, args)
+    except TskError as e:
+        sys.stderr.write('tsk: {}\n'.format(e))
+        return 1
+    return 0
+
+if __name__=='__main__':
+    sys.exit(main())
@@ -0,0 +1,157 @@
+# coding=utf8
+"""
+precompressed sidecars of the web pages, e.g. `page.html.gz` next to
+`page.html`, for servers looking for them (nginx's gzip_static and
+brotli_static). brotli needs `pip install tsk[brotli]`.
+"""
+import os
+import gzip
+import tempfile
+import cStringIO
+from multiprocessing.pool import ThreadPool
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from .utils import TskError
+
+
+def gzip_data(data, level):
+    buf = cStringIO.StringIO()
+    # no name and a fixed mtime, the same page always compresses the same
+    with gzip.GzipFile(fileobj=buf, mode='wb', compresslevel=level,
+                       mtime=0) as f:
+        f.write(data)
+    return buf.getvalue()
+
+def brotli_data(data, level):
+    return brotli.compress(data, quality=level)
+
+# extension of the sidecars, function and default level of each format
+FORMATS = {
+    'gz': (gzip_data, 9),
+    'br': (brotli_data, 11),
+}
+
+
+class Compressor(object):
+    """
+    writes the sidecars of `formats` for files with one of `extensions`,
+    in a pool of `threads`: zlib and brotli let go of the GIL while they
+    compress. `levels` overrides the default level of formats.
+
+    a sidecar gets the mtime of the file it compresses. since unchanged
+    outputs aren't rewritten, a sidecar with the mtime of its file is up to
+    date and is left alone.
+    """
+
+    def __init__(self, formats=('gz',), levels=None, threads=4,
+                 extensions=('html', 'htm', 'xml', 'txt', 'css', 'js', 
+                             'json', 'svg')):
+        for fmt in formats:
+            if fmt not in FORMATS:
+                raise TskError('Unknown compression format: {}.'.format(fmt))
+            if fmt=='br' and brotli is None:
+                raise TskError('brotli is not installed. '
+                               'pip install tsk[brotli]')
+        self.formats = tuple(formats)
+        self.levels = dict((fmt, level) for fmt, (f, level)
+                           in FORMATS.iteritems())
+        self.levels.update(levels or {})
+        self.threads = threads
+        self.extensions = extensions
+
+    def sidecar(self, path, fmt):
+        return path + '.' + fmt
+
+    def stale(self, path):
+        """
+        formats of `path` whose sidecar is missing or out of date.
+        """
+        mtime = os.stat(path).st_mtime
+        stale = []
+        for fmt in self.formats:
+            try:
+                sidecar_mtime = os.stat(self.sidecar(path, fmt)).st_mtime
+            except OSError:
+                sidecar_mtime = None
+            # utime sets mtimes to the microsecond
+            if sidecar_mtime is not None and abs(sidecar_mtime - mtime) < 1e-5:
+                continue
+            stale.append(fmt)
+        return stale
+
+    def compress_file(self, path, formats=None):
+        """
+        write the sidecars of `path` in `formats` (all by default).
+        """
+        st = os.stat(path)
+        with open(path, 'rb') as f:
+            data = f.read()
+        for fmt in formats or self.formats:
+            compressed = FORMATS[fmt][0](data, self.levels[fmt])
+            sidecar = self.sidecar(path, fmt)
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(sidecar) or '.',
+                                       prefix='.tsk-')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(compressed)
+                os.chmod(tmp, st.st_mode & 0o777)
+                os.utime(tmp, (st.st_atime, st.st_mtime))
+                os.rename(tmp, sidecar)
+            except:
+                os.remove(tmp)
+                raise
+
+    def files(self, directory):
+        """
+        files under `directory` to compress, and sidecars whose file is
+        gone.
+        """
+        files, orphans = [], []
+        sidecars = tuple('.' + fmt for fmt in FORMATS)
+        ext = lambda name: os.path.splitext(name)[1][1:].lower()
+        for root, dirs, names in os.walk(directory):
+            names = set(names)
+            for name in names:
+                path = os.path.join(root, name)
+                if name.startswith('.tsk-'):
+                    # being written
+                    continue
+                if name.endswith(sidecars):
+                    base = os.path.splitext(name)[0]
+                    if ext(base) in self.extensions and base not in names:
+                        orphans.append(path)
+                elif ext(name) in self.extensions:
+                    files.append(path)
+        return files, orphans
+
+    def compress(self, directory):
+        """
+        bring the sidecars of the files under `directory` up to date and
+        remove the ones left by deleted files. returns the files compressed.
+        """
+        files, orphans = self.files(directory)
+        for path in orphans:
+            os.remove(path)
+        work = []
+        for path in files:
+            stale = self.stale(path)
+            if stale:
+                work.append((path, stale))
+        if not work:
+            return []
+        if self.threads > 1 and len(work) > 1:
+            pool = ThreadPool(min(self.threads, len(work)))
+            try:
+                pool.map(lambda (path, stale): self.compress_file(path, stale),
+                         work)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            for path, stale in work:
+                self.compress_file(path, stale)
+        return [path for path, stale in work]
@@ -0,0 +1,63 @@
+# coding=utf8
+import os
+
+class DependencyGraph(object):
+    """
+    edges from generated outputs to the files they were built from, i.e.
+    markdown sources, layout templates and whatever they extend or include,
+    partials pulled in by commands and the toc. paths are kept absolute so
+    that queries match whatever form the config used.
+
+        graph.set('website/intro.html', ['templates/main.html'])
+        graph.affected('templates/main.html') 
+        # -> set(['/path/to/website/intro.html'])
+    """
+
+    def __init__(self, edges=None):
+        self.edges = {}
+        self._dependents = None
+        for output, deps in (edges or {}).iteritems():
+            self.set(output, deps)
+
+    def set(self, output, deps):
+        """
+        replace the dependencies of `output`.
+        """
+        self.edges[os.path.abspath(output)] = set(
+            os.path.abspath(d) for d in deps)
+        self._dependents = None
+
+    def remove(self, output):
+        self.edges.pop(os.path.abspath(output), None)
+        self._dependents = None
+
+    def dependencies(self, output):
+        return self.edges.get(os.path.abspath(output), set())
+
+    def affected(self, *files):
+        """
+        outputs depending on any of `files`.
+        """
+        if self._dependents is None:
+            # reverse index, rebuilt after each change to the graph
+            self._dependents = {}
+            for output, deps in self.edges.iteritems():
+                for d in deps:
+                    self._dependents.setdefault(d, set()).add(output)
+        rv = set()
+        for f in files:
+            rv |= self._dependents.get(os.path.abspath(f), set())
+        return rv
+
+    def outputs(self):
+        return set(self.edges)
+
+    def files(self):
+        rv = set()
+        for deps in self.edges.itervalues():
+            rv |= deps
+        return rv
+
+    def to_dict(self):
+        return dict((output, sorted(deps)) 
+                    for output, deps in self.edges.iteritems())
@@ -1,14 +1,36 @@
 # coding=utf8
 import os
+import sys
 import shutil
 import re
 import StringIO
+import cStringIO
+import json
+import hashlib
+import tempfile
+import threading
+import functools
+import time
 
-import markdown
-from jinja2 import Environment, FileSystemLoader
-
-from .utils import slugify, TskError, basename_no_ext
+from .utils import (slugify, TskError, basename_no_ext, file_hash, 
+                    file_stat, sync_file, lazy_import)
 from .toc import TOC
+from .manifest import Manifest, _native
+from .depgraph import DependencyGraph
+from .cache import CommandCache
+
+# only needed to render markdown or templates or in parallel, a build with
+# nothing to render doesn't import them. optional features import their 
+# modules when configured.
+markdown = lazy_import('markdown')
+jinja2 = lazy_import('jinja2')
+jinja_meta = lazy_import('jinja2.meta')
+multiprocessing = lazy_import('multiprocessing')
+
+# outputs are written to a temporary file first, created with mode 0600:
+# they're given the permissions `open` would have given them instead
+_UMASK = os.umask(0)
+os.umask(_UMASK)
 
 """
 TODO:
@@ -35,6 +57,30 @@ def bound_command(command):
     command.force_bound = True
     return command
 
+def memoized_command(command=None, files=None):
+    """
+    let the generator reuse the results of the user-defined command for the
+    same arguments, as long as the files it read are unchanged: the ones
+    named by `files(generator, *args)` and the ones it passed to 
+    `add_dependency`. results have to be strings.
+
+        @memoized_command(files=lambda self, name: [
+            os.path.join(self.MARKDOWN_PATH, 'data', name)])
+        @bound_command
+        def tsk_command_csv_table(self, name):
+            ...
+
+    results are kept for the lifetime of the generator, and across builds
+    in COMMAND_CACHE_FILE if it's set.
+    """
+    def memoize(command):
+        command.memoize = True
+        command.memoize_files = files
+        return command
+    if command is None:
+        return memoize
+    return memoize(command)
+
 @bound_command
 def tsk_command_include(self, item):
     """
@@ -45,16 +91,8 @@ def tsk_command_include(self, item):
 
     """
     item_path = os.path.join(self.MARKDOWN_PATH, 'partials', item)
-    partial_output_dir = os.path.join(self.TEMPLATE_PATH, 'partials')
-    if not os.path.exists(partial_output_dir):
-        os.makedirs(partial_output_dir)
-    item_output_path = os.path.join(partial_output_dir, item)
-    #TODO: copy item to the partials directory
-    try:
-        shutil.copy(item_path, item_output_path)
-        return "{{% include 'partials/{item}' %}}".format(item=item)
-    except:
-        return "[ ... ]"
+    self.add_dependency(item_path)
+    return self.sync_partial(item)
 
 @bound_command
 def tsk_command_anchor(self, *items):
@@ -68,10 +106,108 @@ def tsk_command_anchor(self, *items):
     anchor = slugify(' '.join(items))
     return '<p><a id="{anchor}"></a></p>'.format(anchor=anchor)
 
+def concurrent_command(command):
+    """
+    let the generator run the user-defined command in a thread while the
+    markdown around it is preprocessed, alongside the other concurrent 
+    commands of the file. meant for commands waiting on i/o: large files,
+    databases. the command is handed its arguments only, and must not rely
+    on what other commands of the file did.
+    """
+    command.concurrent = True
+    return command
+
+def _cacheable(result):
+    """
+    command results are kept as json, i.e. unicode or utf8 strings.
+    """
+    if isinstance(result, str):
+        try:
+            result.decode('utf8')
+        except UnicodeDecodeError:
+            return False
+        return True
+    return isinstance(result, unicode)
+
+# generator handed to pool workers. set right before the pool is created so
+# that forked workers inherit it along with its registered commands.
+_worker_generator = None
+
+def _render_in_worker(filename):
+    # results of memoized commands go back with the file
+    return (filename, _worker_generator._render_markdown_file(filename),
+            _worker_generator.command_cache.take_added())
+
 class Generator(object):
 
     TSK_COMMAND_PREFIX = 'tsk_command_'
     TOC_FILE = None
+    # skip sources that haven't changed since the last build
+    INCREMENTAL = False
+    # defaults to `.tsk-manifest.json` next to MARKDOWN_OUTPUT_DIR
+    MANIFEST_FILE = None
+    # number of processes rendering markdown
+    JOBS = 1
+    # python-markdown extensions and their configs, e.g.
+    # MARKDOWN_EXTENSIONS = ['markdown.extensions.toc']
+    # MARKDOWN_EXTENSION_CONFIGS = {'markdown.extensions.toc': {'marker': ''}}
+    MARKDOWN_EXTENSIONS = ()
+    MARKDOWN_EXTENSION_CONFIGS = {}
+    # directory for jinja's compiled templates, kept between builds
+    JINJA_CACHE_DIR = None
+    # keep rendered markdown in memory and hand it straight to the layout
+    # instead of going through MARKDOWN_OUTPUT_DIR
+    IN_MEMORY = False
+    # still write rendered markdown to MARKDOWN_OUTPUT_DIR in IN_MEMORY mode
+    DEBUG_MARKDOWN_OUTPUT = False
+    # template of the navigation shared by all pages, rendered once with 
+    # `toc` and an `active(entry)` function marking where ACTIVE_NAV_MARKER
+    # goes on the current page's entries, e.g.
+    #   <a href="{{ e.url }}"{{ active(e) }}>{{ e.title }}</a>
+    # the result is given to layouts as `data.nav`
+    NAV_TEMPLATE = None
+    ACTIVE_NAV_MARKER = ' class="active"'
+    # templates compiled ahead of time by `precompile_templates`
+    TEMPLATE_EXTENSIONS = ('html', 'htm', 'xml', 'txt')
+    # hardlink included partials into TEMPLATE_PATH instead of copying them
+    LINK_PARTIALS = False
+    # file keeping the results of memoized commands between builds, and
+    # how many of them are kept
+    COMMAND_CACHE_FILE = None
+    COMMAND_CACHE_SIZE = 1000
+    # threads running concurrent commands, and how long in seconds the 
+    # commands of a file may take once it's preprocessed
+    COMMAND_THREADS = 4
+    COMMAND_TIMEOUT = None
+    # precompressed sidecars written next to the web pages, e.g. 
+    # COMPRESS = ('gz', 'br'), with levels overriding the defaults of 9 for
+    # gzip and 11 for brotli, e.g. COMPRESS_LEVELS = {'br': 9}
+    COMPRESS = ()
+    COMPRESS_LEVELS = {}
+    COMPRESS_THREADS = 4
+    # files of WEB_PAGES_PATH compressed, by extension
+    COMPRESS_EXTENSIONS = ('html', 'htm', 'xml', 'txt', 'css', 'js', 'json', 
+                           'svg')
+    # threads writing web pages while the next ones are rendered, 0 writes
+    # them in turn, and how many pages may wait to be written
+    WRITER_THREADS = 0
+    WRITER_QUEUE = 32
+    # directory of WEB_PAGES_PATH receiving the search index of the book,
+    # see `tsk.search`, and the length of the term prefixes it's sharded by
+    SEARCH_INDEX_DIR = None
+    SEARCH_PREFIX_LENGTH = 2
+    # sqlite file keeping rendered markdown and pages by the hash of what
+    # they're made of, to be shared between machines, see `tsk.buildcache`.
+    # commands have to give the same results for the same files.
+    BUILD_CACHE = None
+    # number of builds an unused entry is kept for
+    BUILD_CACHE_KEEP = 5
+    # pages kept rendered by the admin app's preview, see `tsk.admin`
+    PREVIEW_CACHE_SIZE = 200
+    # sqlite catalog of the meta of the sources, for the admin app to list
+    # them, see `tsk.catalog`. defaults to `.tsk-catalog.sqlite` next to the
+    # manifest
+    CATALOG_FILE = None
 
     def __init__(self, config):
         for k, v in config.iteritems():
@@ -88,14 +224,101 @@ class Generator(object):
         if not os.path.exists(markdown_partials):
             os.makedirs(os.path.join(self.MARKDOWN_PATH, 'partials'))
 
-        self.jinja_environ = Environment(
-            loader=FileSystemLoader(self.TEMPLATE_PATH),
-            #lstrip_blocks=True,
-            #trim_blocks=True
-        )
+        if self.JINJA_CACHE_DIR and not os.path.exists(self.JINJA_CACHE_DIR):
+            os.makedirs(self.JINJA_CACHE_DIR)
+        self._jinja_environ = None
 
         # registery linking input and output names for markdown files
         self.book = {}
+        # rendered markdown by output file, in IN_MEMORY mode
+        self.contents = {}
+
+        # record of the previous build for incremental builds
+        self.manifest = None
+        if self.INCREMENTAL:
+            self.manifest = Manifest(self._manifest_path())
+        # input files restored from the manifest during this build
+        self._unchanged = set()
+
+        # outputs and the files they're made of, only recorded when
+        # something uses them: incremental builds or `rebuild`
+        self.dependencies = DependencyGraph(
+            self.manifest.graph if self.manifest else None)
+        self.track_dependencies = self.manifest is not None
+        # files read by commands while preprocessing the current markdown
+        self._dependencies = set()
+        # files and toc usage of each template, per build
+        self._template_deps = {}
+        # outputs written and left untouched because unchanged, per build
+        self.write_stats = {'written': 0, 'skipped': 0}
+        self._stats_lock = threading.Lock()
+        # writes pages in the background during generate_webpages
+        self._writer = None
+        # partials brought to TEMPLATE_PATH, per build
+        self._partials = {}
+        # results of memoized commands
+        self.command_cache = CommandCache(self.COMMAND_CACHE_FILE, 
+                                          self.COMMAND_CACHE_SIZE)
+        self.compressor = None
+        if self.COMPRESS:
+            from .compress import Compressor
+            self.compressor = Compressor(self.COMPRESS, self.COMPRESS_LEVELS,
+                                         self.COMPRESS_THREADS, 
+                                         self.COMPRESS_EXTENSIONS)
+        self.search_index = None
+        if self.SEARCH_INDEX_DIR:
+            from .search import SearchIndex
+            self.search_index = SearchIndex(
+                os.path.join(self.WEB_PAGES_PATH, self.SEARCH_INDEX_DIR),
+                os.path.join(os.path.dirname(self._manifest_path()), 
+                             '.tsk-search.json'),
+                self.SEARCH_PREFIX_LENGTH, write=self.write_output)
+        self.build_cache = None
+        if self.BUILD_CACHE:
+            from .buildcache import BuildCache
+            self.build_cache = BuildCache(self.BUILD_CACHE, 
+                                          self.BUILD_CACHE_KEEP)
+        # content hashes of files, per build
+        self._hashes = {}
+        # concurrent commands of the markdown being preprocessed, and the
+        # threads running them with the process they belong to
+        self._pending = None
+        self._command_pool = None
+
+        # markdown converters are reused, one per thread (and process)
+        self._local = threading.local()
+
+    def _manifest_path(self):
+        if self.MANIFEST_FILE:
+            return self.MANIFEST_FILE
+        output_dir = os.path.normpath(self.MARKDOWN_OUTPUT_DIR)
+        return os.path.join(os.path.dirname(output_dir), '.tsk-manifest.json')
+
+    def _render_signature(self):
+        """
+        hash of the settings that affect how markdown is rendered.
+        """
+        def _stable(ext):
+            # extensions can be given as instances, whose repr changes
+            # from one run to the next
+            if isinstance(ext, basestring):
+                return ext
+            cls = type(ext)
+            return '{}.{}:{!r}'.format(cls.__module__, cls.__name__, 
+                                       sorted(ext.getConfigs().items()))
+        h = hashlib.sha1()
+        h.update(repr([_stable(e) for e in self.MARKDOWN_EXTENSIONS]))
+        h.update(repr(sorted(self.MARKDOWN_EXTENSION_CONFIGS.items())))
+        return h.hexdigest()
+
+    def _book_signature(self):
+        """
+        hash of the set of pages in the book, which decides the toc's urls.
+        """
+        # keys are byte strings from file names or unicode from titles
+        keys = [k.encode('utf8') if isinstance(k, unicode) else k 
+                for k in self.book]
+        return hashlib.sha1('\0'.join(sorted(keys))).hexdigest()
 
     def _markdown_output_filename(self, meta):
         output_file = meta.get('output_file', None)
@@ -107,41 +330,232 @@ class Generator(object):
         return output_file
 
     def traverse_markdown_dir(self):
+        toc_file = self.TOC_FILE and os.path.join(self.MARKDOWN_PATH, 
+                                                  self.TOC_FILE)
         for f in os.listdir(self.MARKDOWN_PATH):
             f = os.path.join(self.MARKDOWN_PATH, f)
-            if f!= self.TOC_FILE and f.endswith('.md') and os.path.isfile(f):
+            if f!= toc_file and f.endswith('.md') and os.path.isfile(f):
                 yield f
 
     def write_output(self, file, data):
+        """
+        write `data` to `file`, unless it already holds exactly that: its
+        mtime is left alone for rsync, CDNs and the like. the data goes to a
+        temporary file renamed over `file` so an interrupted build never
+        leaves it half written. returns whether `file` was written.
+        """
         try:
             data = data.encode('utf8')
         except UnicodeDecodeError as e:
             pass
-        with open(file, 'w') as f:
-            f.write(data)
+        if self._output_unchanged(file, data):
+            with self._stats_lock:
+                self.write_stats['skipped'] += 1
+            return False
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(file) or '.', 
+                                   prefix='.tsk-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.chmod(tmp, 0o666 & ~_UMASK)
+            os.rename(tmp, file)
+        except:
+            os.remove(tmp)
+            raise
+        with self._stats_lock:
+            self.write_stats['written'] += 1
+        return True
+
+    def _output_unchanged(self, file, data):
+        """
+        compare sizes first, contents only when they match.
+        """
+        try:
+            if os.path.getsize(file)!=len(data):
+                return False
+            with open(file, 'rb') as f:
+                return f.read()==data
+        except (IOError, OSError):
+            return False
 
     def process_markdown_file(self, filename):
+        meta, contents = self._render_markdown_file(filename)
+        self._store_markdown_file(filename, meta, contents)
+        return meta
+
+    def _render_markdown_file(self, filename):
+        """
+        preprocess and render a markdown file, without side effects on the
+        generator, so that it can run in a worker process.
+        """
         with open(filename, 'r') as f:
-            meta, contents = self.preprocess_markdown(f.read())
-            contents = self.render_markdown(contents)
-            meta['input_file'] = os.path.basename(filename)
-            meta['output_file'] = self._markdown_output_filename(meta)
-            meta['output_path'] = os.path.join(self.MARKDOWN_OUTPUT_DIR, 
-                                               meta['output_file'])
+            meta, contents = self.preprocess_markdown(f)
+        contents = self.render_markdown(contents)
+        meta['input_file'] = os.path.basename(filename)
+        meta['output_file'] = self._markdown_output_filename(meta)
+        meta['output_path'] = os.path.join(self.MARKDOWN_OUTPUT_DIR, 
+                                           meta['output_file'])
+        return meta, contents
+
+    def _store_markdown_file(self, filename, meta, contents, cached=False):
+        if self.build_cache and not cached:
+            self._cache_markdown_file(filename, meta, contents)
+        outputs = []
+        if self.IN_MEMORY:
+            self.contents[meta['output_file']] = contents
+        if not self.IN_MEMORY or self.DEBUG_MARKDOWN_OUTPUT:
             self.write_output(meta['output_path'], contents)
-            self.book[meta['output_file']] = meta
+            outputs.append(meta['output_path'])
+        self.book[meta['output_file']] = meta
+        if self.manifest:
+            self.manifest.record(filename, meta, outputs)
+            for path in meta.get('dependencies', []):
+                self.manifest.record_file(path)
+
+    def _restore_markdown_file(self, filename):
+        """
+        put back the book entry of an unchanged source from the manifest.
+        """
+        meta = self.manifest.restore(filename)
+        if meta is None:
+            return False
+        # commands have to run again if the files they read changed
+        for path in meta.get('dependencies', []):
+            if self.manifest.file_changed(path):
+                return False
+        self.book[meta['output_file']] = meta
+        self._unchanged.add(meta['input_file'])
+        return True
+
+    def _file_hash(self, path):
+        if path not in self._hashes:
+            self._hashes[path] = (file_hash(path) if os.path.isfile(path) 
+                                  else None)
+        return self._hashes[path]
+
+    def _markdown_cache_key(self, filename):
+        from .buildcache import cache_key
+        if not hasattr(self, '_renderer'):
+            self._renderer = self._render_signature()
+        return cache_key('markdown', self._renderer, 
+                         os.path.basename(filename), self._file_hash(filename))
+
+    def _cache_markdown_file(self, filename, meta, contents):
+        """
+        keep the results of a source in the build cache, with the files its
+        commands read relative to MARKDOWN_PATH.
+        """
+        base = os.path.abspath(self.MARKDOWN_PATH)
+        deps = [(os.path.relpath(p, base), self._file_hash(p)) 
+                for p in meta.get('dependencies', [])]
+        meta = dict((k, v) for k, v in meta.iteritems() 
+                    if k not in ('dependencies', 'output_path'))
+        self.build_cache.put(self._markdown_cache_key(filename), json.dumps(
+            {'meta': meta, 'deps': deps, 'contents': contents}))
+
+    def _restore_from_build_cache(self, filename):
+        value = self.build_cache.get(self._markdown_cache_key(filename))
+        if value is None:
+            return False
+        entry = json.loads(value)
+        base = os.path.abspath(self.MARKDOWN_PATH)
+        deps = [os.path.abspath(os.path.join(base, _native(path)))
+                for path, h in entry['deps']]
+        for path, (rel, h) in zip(deps, entry['deps']):
+            if self._file_hash(path)!=h:
+                return False
+        meta = _native(entry['meta'])
+        meta['output_path'] = os.path.join(self.MARKDOWN_OUTPUT_DIR, 
+                                           meta['output_file'])
+        if deps:
+            meta['dependencies'] = sorted(deps)
+        # what the include command would have done
+        partials = os.path.join(base, 'partials', '')
+        for path in deps:
+            if path.startswith(partials):
+                self.sync_partial(path[len(partials):])
+        self._store_markdown_file(filename, meta, entry['contents'], 
+                                  cached=True)
+        return True
 
-    # TODO: testing
     def preprocess_markdown(self, text):
         """
         receive custom/extended markdown, extract meta information, run
         user-defined commands and return meta dict and standard markdown.
+
+        `text` is a string or any iterable of lines, e.g. an open file.
+        """
+        if isinstance(text, basestring):
+            # iterate the text without copying it into a list of lines. 
+            # cStringIO is much faster but only takes byte strings.
+            if isinstance(text, unicode):
+                text = StringIO.StringIO(text)
+            else:
+                text = cStringIO.StringIO(text)
+        meta = {}
+        self._dependencies = set()
+        self._pending = []
+        try:
+            md = ''.join(self.iter_preprocess_markdown(text, meta))
+            if self._pending:
+                md = self._fill_placeholders(md)
+        finally:
+            self._pending = None
+        if self._dependencies:
+            meta['dependencies'] = sorted(self._dependencies)
+        return meta, md 
+
+    def read_markdown_meta(self, filename):
+        """
+        meta of markdown `filename` along with its input and output files,
+        read from its first meta block alone: reading stops where the block
+        closes, no command runs and nothing is rendered.
         """
         meta = {}
         meta_mode = False
         comment_mode = False
-        md = ''
-        for line in StringIO.StringIO(text).readlines():
+        meta_key = None
+        with open(filename, 'r') as f:
+            for line in f:
+                l = line.strip()
+                if l=='-#-':
+                    comment_mode = not comment_mode
+                if comment_mode:
+                    continue
+                if l=='---':
+                    if meta_mode:
+                        break
+                    meta_mode = True
+                    continue
+                if meta_mode:
+                    new_meta_key, meta_value = self._process_meta_line(l)
+                    meta_key = new_meta_key or meta_key
+                    meta.setdefault(meta_key, []).append(meta_value)
+        meta['input_file'] = os.path.basename(filename)
+        meta['output_file'] = self._markdown_output_filename(meta)
+        meta['output_path'] = os.path.join(self.MARKDOWN_OUTPUT_DIR, 
+                                           meta['output_file'])
+        return meta
+
+    def scan_markdown(self, filenames=None):
+        """
+        the book as the meta blocks of `filenames` (every source by 
+        default) describe it, by output file. a fraction of the cost of
+        processing them, see `read_markdown_meta`.
+        """
+        if filenames is None:
+            filenames = self.traverse_markdown_dir()
+        return dict((meta['output_file'], meta) for meta in 
+                    (self.read_markdown_meta(f) for f in filenames))
+
+    def iter_preprocess_markdown(self, lines, meta):
+        """
+        stream standard markdown out of the custom/extended markdown `lines`,
+        one chunk at a time, filling `meta` along the way.
+        """
+        meta_mode = False
+        comment_mode = False
+        for line in lines:
             l = line.strip()
 
             if l=='-#-':
@@ -168,11 +582,73 @@ class Generator(object):
             elif l.startswith('$$'):
                 args = l[2:].strip().split()
                 command = args.pop(0)
-                md += self.exec_command(command, args)
+                yield self.exec_command(command, args)
             else:
-                md += line
+                yield line
 
-        return meta, md 
+    def add_dependency(self, path):
+        """
+        declare a file read by a command, so that the markdown being
+        preprocessed is processed again when that file changes.
+        """
+        path = os.path.abspath(path)
+        self._dependencies.add(path)
+        # memoized commands running in this thread
+        for read in getattr(self._local, 'reads', ()):
+            read.add(path)
+
+    # concurrent commands stand in the markdown as \x02<index>\x03 until
+    # their results are in
+    PLACEHOLDER = re.compile(r'\x02(\d+)\x03')
+
+    def _submit_command(self, command, args):
+        pool = self._command_pool
+        if pool is None or pool[0]!=os.getpid():
+            # threads don't survive a fork, pool workers get their own
+            from multiprocessing.pool import ThreadPool
+            pool = self._command_pool = (os.getpid(), 
+                                         ThreadPool(self.COMMAND_THREADS))
+        self._pending.append(pool[1].apply_async(command, args))
+        return '\x02{}\x03'.format(len(self._pending) - 1)
+
+    def _fill_placeholders(self, md):
+        """
+        wait for the concurrent commands of the markdown and put their 
+        results in place.
+        """
+        results = []
+        deadline = self.COMMAND_TIMEOUT and time.time() + self.COMMAND_TIMEOUT
+        for pending in self._pending:
+            timeout = deadline and max(0, deadline - time.time())
+            try:
+                # without a timeout, get() can't be interrupted by ctrl-c
+                results.append(pending.get(timeout or 1e9))
+            except multiprocessing.TimeoutError:
+                raise TskError('Commands still running after {} seconds.'
+                               .format(self.COMMAND_TIMEOUT))
+        return self.PLACEHOLDER.sub(lambda m: results[int(m.group(1))], md)
+
+    def sync_partial(self, item):
+        """
+        bring partial `item` from MARKDOWN_PATH/partials to 
+        TEMPLATE_PATH/partials, once per build and only if it changed, and
+        return what includes it in the markdown. a missing partial is 
+        included as `[ ... ]`.
+        """
+        include = self._partials.get(item)
+        if include is None:
+            src = os.path.join(self.MARKDOWN_PATH, 'partials', item)
+            dst_dir = os.path.join(self.TEMPLATE_PATH, 'partials')
+            if not os.path.isfile(src):
+                include = '[ ... ]'
+            else:
+                if not os.path.isdir(dst_dir):
+                    os.makedirs(dst_dir)
+                sync_file(src, os.path.join(dst_dir, item), 
+                          link=self.LINK_PARTIALS)
+                include = "{{% include 'partials/{item}' %}}".format(item=item)
+            self._partials[item] = include
+        return include
 
     def _process_meta_line(self, line):
         # if in meta_mode we grab each key value pair
@@ -239,10 +715,49 @@ class Generator(object):
         if hasattr(self, name):
             raise NameError('This command name is already in use. '
                                  'Register with a different name.')
-        if bound or command.force_bound:
+        memoize = getattr(command, 'memoize', False)
+        if memoize:
+            files = command.memoize_files
+        if bound or getattr(command, 'force_bound', False):
             command = command.__get__(self, type(self))
+        if memoize:
+            command = self._memoized(name, command, files)
         setattr(self, name, command)
 
+    def _memoized(self, name, command, files):
+        """
+        wrap `command` to go through `command_cache`.
+        """
+        @functools.wraps(command)
+        def memoized(*args):
+            declared = set()
+            if files:
+                declared.update(os.path.abspath(p) for p in files(self, *args))
+            key = json.dumps([name] + list(args))
+            entry = self.command_cache.get(
+                key, lambda paths: [file_stat(p) for p in paths])
+            if entry is not None:
+                result, read = entry
+                for path, state in read:
+                    self.add_dependency(path)
+                return result
+            # the files read by this command alone, which may run in a 
+            # thread next to others
+            for path in declared:
+                self.add_dependency(path)
+            reads = self._local.__dict__.setdefault('reads', [])
+            read = set(declared)
+            reads.append(read)
+            try:
+                result = command(*args)
+            finally:
+                reads.pop()
+            if _cacheable(result):
+                self.command_cache.set(key, result, 
+                                       [(p, file_stat(p)) for p in sorted(read)])
+            return result
+        return memoized
+
     def exec_command(self, command, args=None):
         """
         execute user-defined commands in markdown
@@ -253,6 +768,9 @@ class Generator(object):
             args = []
         command = getattr(self, command)
         if command:
+            if self._pending is not None and getattr(command, 'concurrent', 
+                                                     False):
+                return self._submit_command(command, args)
             return command(*args)
         raise NameError('No command registered with that name.')
 
@@ -265,10 +783,43 @@ class Generator(object):
         # small hack to allow the meta extension to see the markers
         # text = re.sub(r'^\+\+\+\s*$', '---', text, flags=re.M)
         # end of hack
-        md = markdown.Markdown(output_format='html5')
+        md = self.markdown_converter
+        md.reset()
         html = md.convert(text)
         return html
 
+    @property
+    def markdown_converter(self):
+        """
+        the `markdown.Markdown` instance of the current thread, created on
+        first use with MARKDOWN_EXTENSIONS and MARKDOWN_EXTENSION_CONFIGS.
+        """
+        md = getattr(self._local, 'converter', None)
+        if md is None:
+            md = self._local.converter = markdown.Markdown(
+                output_format='html5', 
+                extensions=list(self.MARKDOWN_EXTENSIONS),
+                extension_configs=self.MARKDOWN_EXTENSION_CONFIGS)
+        return md
+
+    @property
+    def jinja_environ(self):
+        """
+        the jinja environment of TEMPLATE_PATH, created on first use.
+        """
+        if self._jinja_environ is None:
+            bytecode_cache = None
+            if self.JINJA_CACHE_DIR:
+                bytecode_cache = jinja2.FileSystemBytecodeCache(
+                    self.JINJA_CACHE_DIR)
+            self._jinja_environ = jinja2.Environment(
+                loader=jinja2.FileSystemLoader(self.TEMPLATE_PATH),
+                bytecode_cache=bytecode_cache,
+                #lstrip_blocks=True,
+                #trim_blocks=True
+            )
+        return self._jinja_environ
+
     def render_jinja_template(self, contents_template, template=None, 
                               data=None, toc=None):
         template = template or self.DEFAULT_TEMPLATE
@@ -277,36 +828,306 @@ class Generator(object):
                              toc=toc)
         return rv
 
-    def process_markdown(self):
+    def precompile_templates(self):
+        """
+        compile every template under TEMPLATE_PATH so that their bytecode
+        lands in JINJA_CACHE_DIR ahead of the build.
+        """
+        if not self.JINJA_CACHE_DIR:
+            raise TskError('JINJA_CACHE_DIR must be set to precompile templates.')
+        names = self.jinja_environ.list_templates(
+            extensions=self.TEMPLATE_EXTENSIONS)
+        for name in names:
+            self.jinja_environ.get_template(name)
+        return names
+
+    def build(self, jobs=None):
+        """
+        process markdown and generate the web pages.
+        """
+        self.write_stats = {'written': 0, 'skipped': 0}
+        self.process_markdown(jobs=jobs)
+        self.generate_webpages()
+
+    def process_markdown(self, jobs=None):
         """ 
         Process and output markdown 
+
+        with `jobs` (or JOBS) above 1, files are preprocessed and rendered in
+        a pool of processes while outputs and the book are handled here.
         """
+        jobs = jobs or self.JOBS
+        input_files = set()
+        pending = []
+        self._partials = {}
+        if self.manifest:
+            self.manifest.reset_checks()
+            renderer = self._render_signature()
+            if renderer!=self.manifest.renderer:
+                # every source has to be rendered again
+                self.manifest.sources.clear()
+                self.manifest.renderer = renderer
+        self._hashes = {}
         for filename in self.traverse_markdown_dir():
-            self.process_markdown_file(filename)
+            input_files.add(os.path.basename(filename))
+            if self.manifest and self._restore_markdown_file(filename):
+                continue
+            if self.build_cache and self._restore_from_build_cache(filename):
+                continue
+            pending.append(filename)
+
+        # the book is complete before anything is rendered: commands see
+        # every page in `book` and `toc`, whichever order files come in
+        scanned = self.scan_markdown(pending)
+        self.book.update(scanned)
+        self._toc = {}
+        if jobs>1 and len(pending)>1:
+            self._process_markdown_in_pool(pending, jobs)
+        else:
+            for filename in pending:
+                self.process_markdown_file(filename)
+        for output_file, meta in scanned.iteritems():
+            if self.book.get(output_file) is meta:
+                # named differently once rendered, e.g. by a later meta 
+                # block
+                del self.book[output_file]
+                self._toc = {}
+
+        if self.manifest:
+            self.manifest.prune(input_files)
+        self.command_cache.save()
+
+    def _process_markdown_in_pool(self, filenames, jobs):
+        """
+        render `filenames` in a pool of `jobs` processes. workers are forked
+        from this process, user commands with side effects on the generator
+        itself will not see them carried back.
+        """
+        global _worker_generator
+        _worker_generator = self
+        self.command_cache.added = {}
+        pool = multiprocessing.Pool(min(jobs, len(filenames)))
+        try:
+            chunksize = max(1, len(filenames) // (jobs * 4))
+            # imap keeps the order of a serial build
+            for filename, (meta, contents), cached in pool.imap(
+                    _render_in_worker, filenames, chunksize):
+                self._store_markdown_file(filename, meta, contents)
+                for key, (result, files) in cached.iteritems():
+                    self.command_cache.set(key, result, files)
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+            _worker_generator = None
+            self.command_cache.added = None
 
     @property
     def toc(self):
         if not getattr(self, '_toc', {}) and self.TOC_FILE:
-            toc_file = os.path.join(self.MARKDOWN_PATH, self.TOC_FILE)
-            t = TOC(toc_file, self.MARKDOWN_OUTPUT_DIR)
-            t.generate()
-            def _add_md_file(tocdata, bookdata):
-                for p in tocdata['children']:
-                    md_data = bookdata.get(p['url'], {})
-                    md_file = md_data.get('input_file', None)
-                    if md_file:
-                        p['markdown'] = md_file
-                    if p.get('children'):
-                        _add_md_file(p, bookdata)
-            if self.book:
-                _add_md_file(t.toc, self.book)
-            self._toc = t.toc
+            self._toc_index = self._load_toc()
+            self._toc = self._toc_index.toc
         return getattr(self, '_toc', {})
 
-    def generate_webpages(self):
+    def _load_toc(self):
+        toc_file = os.path.join(self.MARKDOWN_PATH, self.TOC_FILE)
+        # existence of pages is answered by the book, or the meta of the
+        # sources before anything is processed, rather than by whatever
+        # is left in MARKDOWN_OUTPUT_DIR (nothing in IN_MEMORY mode)
+        book = self.book or self.scan_markdown()
+        t = TOC(toc_file, self.MARKDOWN_OUTPUT_DIR, set(book))
+        t.generate()
+        for entry in t.entries:
+            md_file = book.get(entry['url'], {}).get('input_file')
+            if md_file:
+                entry['markdown'] = md_file
+        return t
+
+    def _contents_template(self, page):
+        """
+        the rendered markdown of `page` as the layout will include it.
+        """
+        if not self.IN_MEMORY:
+            return 'pages/' + page['output_file']
+        return self.jinja_environ.from_string(self._page_contents(page))
+
+    def _page_contents(self, page):
+        """
+        the rendered markdown of `page`.
+        """
+        if not self.IN_MEMORY:
+            path = os.path.join(self.MARKDOWN_OUTPUT_DIR, page['output_file'])
+            with open(path, 'r') as f:
+                return f.read()
+        if page['output_file'] not in self.contents:
+            # restored from the manifest
+            filename = os.path.join(self.MARKDOWN_PATH, page['input_file'])
+            meta, contents = self._render_markdown_file(filename)
+            self.contents[page['output_file']] = contents
+        return self.contents[page['output_file']]
+
+    def _page_template(self, page):
+        template = page.get('template') or self.DEFAULT_TEMPLATE
+        if isinstance(template, list):
+            # meta values are collected in lists
+            template = template[0]
+        return template
+
+    def _template_dependencies(self, name):
+        """
+        files that make up template `name`, following extends, includes and
+        imports, and whether any of them uses the toc.
+        """
+        if name in self._template_deps:
+            return self._template_deps[name]
+        # placeholder in case of cycles
+        self._template_deps[name] = set(), False
+        env = self.jinja_environ
+        try:
+            source, filename, uptodate = env.loader.get_source(env, name)
+        except jinja2.TemplateNotFound:
+            return self._template_deps[name]
+        files, uses_toc = self._source_dependencies(source)
+        files.add(os.path.abspath(filename))
+        self._template_deps[name] = files, uses_toc
+        return files, uses_toc
+
+    # keys of `data` derived from the toc
+    NAV_DATA = ('nav', 'breadcrumbs', 'prev', 'next')
+
+    def _source_dependencies(self, source):
+        """
+        files referenced by template `source` and whether it uses the toc,
+        directly or through the navigation in `data`.
+        """
+        files = set()
+        uses_toc = False
+        if '{' in source:
+            ast = self.jinja_environ.parse(source)
+            uses_toc = 'toc' in jinja_meta.find_undeclared_variables(ast)
+            nodes = jinja2.nodes
+            for node in ast.find_all((nodes.Getattr, nodes.Getitem)):
+                key = getattr(node, 'attr', None)
+                if key is None and isinstance(node.arg, nodes.Const):
+                    key = node.arg.value
+                if (isinstance(node.node, nodes.Name) 
+                    and node.node.name=='data' and key in self.NAV_DATA):
+                    uses_toc = True
+            for ref in jinja_meta.find_referenced_templates(ast):
+                if ref is None:
+                    # dynamic, e.g. `include contents_template`
+                    continue
+                ref_files, ref_toc = self._template_dependencies(ref)
+                files |= ref_files
+                uses_toc = uses_toc or ref_toc
+        return files, uses_toc
+
+    def _page_dependencies(self, page, template, contents_template):
+        files, uses_toc = self._template_dependencies(template)
+        if self.IN_MEMORY:
+            contents_files, contents_toc = self._source_dependencies(
+                self.contents[page['output_file']])
+        else:
+            contents_files, contents_toc = self._template_dependencies(
+                contents_template)
+        deps = files | contents_files
+        deps.add(os.path.join(self.MARKDOWN_PATH, page['input_file']))
+        deps.update(page.get('dependencies', []))
+        if (uses_toc or contents_toc) and self.TOC_FILE:
+            deps.add(os.path.join(self.MARKDOWN_PATH, self.TOC_FILE))
+            if self.NAV_TEMPLATE:
+                deps |= self._template_dependencies(self.NAV_TEMPLATE)[0]
+        return set(os.path.abspath(d) for d in deps)
+
+    def _navigation(self):
+        """
+        NAV_TEMPLATE rendered once for the whole book without any active
+        entry, as text and markup, and the offsets in it where each page url
+        gets its marker.
+        """
+        toc = self.toc
+        if getattr(self, '_nav', (None,))[0] is not toc:
+            marker = u'\0{}\0'
+            html = self.jinja_environ.get_template(self.NAV_TEMPLATE).render(
+                toc=toc, active=lambda entry: marker.format(entry['index']))
+            parts = re.split(u'\0(\\d+)\0', html)
+            offsets = {}
+            offset = 0
+            for i in xrange(0, len(parts), 2):
+                offset += len(parts[i])
+                if i + 1 < len(parts):
+                    entry = self.toc_index.entries[int(parts[i + 1])]
+                    offsets.setdefault(entry['url'], []).append(offset)
+            html = u''.join(parts[::2])
+            self._nav = toc, html, jinja2.Markup(html), offsets
+        return self._nav[1:]
+
+    def _navigation_data(self, page):
+        """
+        navigation for `page`: the shared nav with its entries marked
+        active, breadcrumbs and the previous and next pages.
+        """
+        index = self.toc_index
+        url = page['output_file']
+        entry = index.page_entry(url)
+        rv = dict(breadcrumbs=index.breadcrumbs(entry) if entry else [],
+                  prev=index.prev_page(url), next=index.next_page(url))
+        if self.NAV_TEMPLATE:
+            html, markup, offsets = self._navigation()
+            rv['nav'] = markup
+            if url in offsets:
+                # every page holds the whole nav, this copy is the only
+                # work that grows with the toc
+                chunks = []
+                start = 0
+                for offset in offsets[url]:
+                    chunks.append(html[start:offset])
+                    chunks.append(self.ACTIVE_NAV_MARKER)
+                    start = offset
+                chunks.append(html[start:])
+                rv['nav'] = jinja2.Markup(u''.join(chunks))
+        return rv
+
+    def _page_unchanged(self, page, template, web_file, pages_changed):
+        """
+        whether the web page of an unchanged source can be kept as is.
+        """
+        if (not self.manifest or page['input_file'] not in self._unchanged
+            or not os.path.isfile(web_file)):
+            return False
+        recorded = self.dependencies.dependencies(web_file)
+        layout_files = self._template_dependencies(template)[0]
+        if not recorded or not layout_files <= recorded:
+            # e.g. a different layout
+            return False
+        toc_file = self.TOC_FILE and os.path.abspath(
+            os.path.join(self.MARKDOWN_PATH, self.TOC_FILE))
+        if pages_changed and toc_file in recorded:
+            return False
+        return not any(self.manifest.file_changed(d) for d in recorded)
+
+    def affected_outputs(self, path):
+        """
+        web pages built from `path`, as recorded by the last build.
+        """
+        return self.dependencies.affected(path)
+
+    @property
+    def toc_index(self):
+        """
+        the TOC behind `toc`, with its flat entries and indexes.
+        """
+        return self._toc_index if self.toc else None
+
+    def generate_webpages(self, pages=None):
         """ 
         Insert book's content within template layout and generate static web
         pages. 
+
+        `pages` limits the run to these output files, which are rendered
+        whether they changed or not.
         """
         #if hasattr(self, 'TOC_FILE'):
         #    toc_file = os.path.join(self.MARKDOWN_PATH, self.TOC_FILE)
@@ -314,16 +1135,209 @@ class Generator(object):
         #    toc.generate()
         #    toc = toc.toc
 
-        for k, page in self.book.iteritems():
-            #with open(page['output_path'], 'r') as p:
-            #    contents = p.read().decode('utf8')
-            contents_template = 'pages/' + page['output_file']
-            template = (page['template'] if page.get('template') 
-                        else self.DEFAULT_TEMPLATE)
+        self._template_deps = {}
+        self._book_key = None
+        pages_changed = True
+        if self.manifest:
+            signature = self._book_signature()
+            pages_changed = signature!=self.manifest.pages
+
+        web_files = set()
+        if self.WRITER_THREADS:
+            from .writer import OutputWriter
+            self._writer = OutputWriter(self.write_output, self.WRITER_THREADS,
+                                        self.WRITER_QUEUE)
+        try:
+            for k, page in self.book.iteritems():
+                web_file = os.path.join(self.WEB_PAGES_PATH, 
+                                        page['output_file'])
+                web_files.add(os.path.abspath(web_file))
+                template = self._page_template(page)
+                if pages is not None:
+                    if k not in pages:
+                        continue
+                elif self._page_unchanged(page, template, web_file, 
+                                          pages_changed):
+                    if self.search_index and k not in self.search_index.pages:
+                        self._index_page(page)
+                    continue
+                self._generate_webpage(page, template, web_file)
+        except:
+            if self._writer:
+                # the pages written so far are kept, their errors are not 
+                # the one to report
+                exc_info = sys.exc_info()
+                writer, self._writer = self._writer, None
+                try:
+                    writer.close()
+                except Exception:
+                    pass
+                raise exc_info[0], exc_info[1], exc_info[2]
+            raise
+        if self._writer:
+            # every page is out before anything is recorded
+            writer, self._writer = self._writer, None
+            writer.close()
+
+        if pages is None:
+            for output in self.dependencies.outputs() - web_files:
+                # pages no longer in the book
+                self.dependencies.remove(output)
+
+        if self.search_index:
+            self.search_index.prune(self.book)
+            self.search_index.save()
+
+        if self.build_cache:
+            self.build_cache.commit()
+
+        if self.compressor:
+            # pages and whatever else lives in WEB_PAGES_PATH
+            self.compressor.compress(self.WEB_PAGES_PATH)
+
+        if self.manifest:
+            # only commit the build once all web pages are out
+            self.manifest.pages = signature
+            self.manifest.graph = self.dependencies.to_dict()
+            keep = self.dependencies.files()
+            for meta in self.book.itervalues():
+                keep.update(meta.get('dependencies', []))
+            self.manifest.prune_files(keep)
+            self.manifest.save()
+
+    def _generate_webpage(self, page, template, web_file):
+        contents_template = self._contents_template(page)
+        data = page
+        if self.toc:
+            # the book entry itself stays as the markdown produced it
+            data = dict(page, **self._navigation_data(page))
+        output = key = None
+        if self.build_cache:
+            key = self._page_cache_key(page, template, contents_template, 
+                                       data)
+            output = self.build_cache.get(key)
+        if output is None:
             output = self.render_jinja_template(
                 contents_template=contents_template, 
-                template=template, data=page, toc=self.toc)
-            web_file = os.path.join(self.WEB_PAGES_PATH, page['output_file'])
+                template=template, data=data, toc=self.toc)
+            if key:
+                self.build_cache.put(key, output)
+        if self._writer:
+            self._writer.put(web_file, output)
+        else:
             self.write_output(web_file, output)
+        if self.search_index:
+            self._index_page(page)
+        if not self.track_dependencies:
+            return
+        deps = self._page_dependencies(page, template, contents_template)
+        self.dependencies.set(web_file, deps)
+        if self.manifest:
+            self.manifest.add_output(page['input_file'], web_file)
+            for d in deps:
+                self.manifest.record_file(d)
+
+    def _page_cache_key(self, page, template, contents_template, data):
+        """
+        hash of the contents of the files a page is made of and of the data
+        it's given, leaving paths out.
+        """
+        from .buildcache import cache_key
+        deps = self._page_dependencies(page, template, contents_template)
+        # navigation comes from the toc, counted below
+        skip = ('dependencies', 'output_path') + self.NAV_DATA
+        parts = ['page', template, sorted(self._file_hash(d) for d in deps),
+                 dict((k, v) for k, v in data.iteritems() if k not in skip)]
+        if self.IN_MEMORY:
+            parts.append(self._page_contents(page))
+        if self.TOC_FILE and os.path.abspath(os.path.join(
+                self.MARKDOWN_PATH, self.TOC_FILE)) in deps:
+            # the toc also depends on the pages in the book
+            if self._book_key is None:
+                self._book_key = cache_key(sorted(
+                    (k, m['input_file']) for k, m in self.book.iteritems()))
+            parts.append(self._book_key)
+        return cache_key(*parts)
+
+    def _index_page(self, page):
+        """
+        hand the text of `page` to the search index, with its title and
+        where it stands in the toc.
+        """
+        title = page.get('title')
+        if isinstance(title, list):
+            title = ' '.join(title)
+        doc = {'url': page['output_file'], 'title': title, 'path': [], 
+               'sections': []}
+        entries = self.toc and self.toc_index.by_url.get(page['output_file'])
+        if entries:
+            first = entries[0]
+            doc['title'] = doc['title'] or first['title']
+            doc['path'] = [e['title'] for e in 
+                           self.toc_index.breadcrumbs(first)[:-1]]
+            doc['sections'] = [e['title'] for e in entries[1:]]
+        doc['title'] = doc['title'] or basename_no_ext(page['output_file'])
+        if isinstance(doc['title'], str):
+            doc['title'] = doc['title'].decode('utf8')
+        self.search_index.update(page['output_file'], doc, 
+                                 self._page_contents(page))
+
+    def rebuild(self, paths):
+        """
+        bring the book up to date after `paths` were modified, created or
+        deleted, rendering only what they affect. meant for a generator kept
+        warm between changes, see `tsk.watch`, with `track_dependencies` set
+        before its first build. returns the output files of the pages 
+        generated.
+        """
+        paths = set(os.path.abspath(p) for p in paths)
+        self.write_stats = {'written': 0, 'skipped': 0}
+        self._partials = {}
+        self._hashes = {}
+        if self.manifest:
+            self.manifest.reset_checks()
+        toc_file = self.TOC_FILE and os.path.abspath(
+            os.path.join(self.MARKDOWN_PATH, self.TOC_FILE))
+        markdown_path = os.path.abspath(self.MARKDOWN_PATH)
+
+        sources = set(p for p in paths if p.endswith('.md') and p!=toc_file 
+                      and os.path.dirname(p)==markdown_path)
+        for meta in self.book.itervalues():
+            if paths.intersection(meta.get('dependencies', [])):
+                # its commands read a modified file
+                sources.add(os.path.abspath(
+                    os.path.join(self.MARKDOWN_PATH, meta['input_file'])))
+
+        book_keys = set(self.book)
+        by_input = dict((meta['input_file'], k) 
+                        for k, meta in self.book.iteritems())
+        pages = set()
+        for filename in sources:
+            old = by_input.get(os.path.basename(filename))
+            output_file = None
+            if os.path.isfile(filename):
+                # the book only changes once the file processed fine
+                output_file = self.process_markdown_file(
+                    filename)['output_file']
+                pages.add(output_file)
+            if old and old!=output_file:
+                del self.book[old]
+                self.contents.pop(old, None)
+                self.dependencies.remove(
+                    os.path.join(self.WEB_PAGES_PATH, old))
+        if self.manifest:
+            self.manifest.prune(set(meta['input_file'] 
+                                    for meta in self.book.itervalues()))
+        self.command_cache.save()
 
+        if toc_file and (toc_file in paths or set(self.book)!=book_keys):
+            # pages using the toc are affected by the toc itself and by the
+            # pages it can link to
+            self._toc = {}
+            paths.add(toc_file)
+        pages.update(os.path.basename(f) 
+                     for f in self.dependencies.affected(*paths))
+        pages &= set(self.book)
+        self.generate_webpages(pages=pages)
+        return pages
 
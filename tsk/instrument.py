@@ -0,0 +1,170 @@
+# coding=utf8
+"""
+time where a build goes: preprocessing, user commands, markdown, toc,
+jinja and writing outputs, per file and per command, with the peak memory
+reached by each phase.
+
+    profile = BuildProfile(generator)
+    generator.build()
+    profile.save('profile.json')
+    print profile.summary()
+
+the generator is only touched by `BuildProfile`, which wraps its methods
+on the instance: a generator without one runs exactly the code it would
+run otherwise. with JOBS above 1 markdown is rendered in worker processes
+and only what happens in this one is measured, profile with `jobs=1`.
+"""
+import os
+import json
+import time
+import functools
+import threading
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+def peak_memory():
+    """
+    maximum resident set size of the process so far, in kilobytes on linux
+    (bytes on os x), None where the resource module isn't available.
+    """
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class BuildProfile(object):
+    """
+    instruments `generator` for the builds that follow. a phase only counts
+    its own time, e.g. the commands a file runs aren't counted in its
+    preprocessing. page times include every phase run for the page,
+    rendering its markdown and its web page.
+    """
+    # generator methods and the phase they're timed as
+    PHASES = (
+        ('preprocess_markdown', 'preprocess'),
+        ('exec_command', 'commands'),
+        ('render_markdown', 'markdown'),
+        ('_load_toc', 'toc'),
+        ('render_jinja_template', 'jinja'),
+        ('write_output', 'write'),
+    )
+    SLOWEST = 20
+
+    def __init__(self, generator):
+        self.generator = generator
+        self.reset()
+        for method, phase in self.PHASES:
+            self._wrap_phase(method, phase)
+        self._wrap_page('process_markdown_file',
+                        lambda args, meta: meta['output_file'])
+        self._wrap_page('_generate_webpage',
+                        lambda args, rv: args[0]['output_file'])
+        self._wrap_total('build')
+        self._wrap_total('rebuild')
+
+    def reset(self):
+        self.total = 0.0
+        self.phases = {}
+        self.commands = {}
+        self.pages = {}
+        # time spent in nested phases, one entry per phase running in each
+        # thread, e.g. pages written in the background
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _wrap(self, name, timed):
+        method = getattr(self.generator, name)
+        wrapper = functools.wraps(method)(
+            lambda *args, **kwargs: timed(method, args, kwargs))
+        setattr(self.generator, name, wrapper)
+
+    def _wrap_phase(self, name, phase):
+        def timed(method, args, kwargs):
+            stack = self._local.__dict__.setdefault('nested', [])
+            stack.append(0.0)
+            start = time.time()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                elapsed = time.time() - start
+                nested = stack.pop()
+                if stack:
+                    stack[-1] += elapsed
+                self._record(self.phases, phase, elapsed - nested, 
+                             peak_memory())
+                if phase=='commands':
+                    # commands as the markdown names them, with their
+                    # nested phases
+                    self._record(self.commands, args[0], elapsed)
+        self._wrap(name, timed)
+
+    def _wrap_page(self, name, page_name):
+        def timed(method, args, kwargs):
+            start = time.time()
+            rv = method(*args, **kwargs)
+            self._record(self.pages, page_name(args, rv),
+                         time.time() - start)
+            return rv
+        self._wrap(name, timed)
+
+    def _wrap_total(self, name):
+        def timed(method, args, kwargs):
+            start = time.time()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                self.total += time.time() - start
+        self._wrap(name, timed)
+
+    def _record(self, stats, key, elapsed, memory=False):
+        with self._lock:
+            s = stats.get(key)
+            if s is None:
+                s = stats[key] = {'time': 0.0, 'calls': 0}
+            s['time'] += elapsed
+            s['calls'] += 1
+            if memory is not False:
+                s['peak_memory'] = max(s.get('peak_memory'), memory)
+
+    def slowest(self, n=None):
+        """
+        the `n` (SLOWEST) slowest pages as (output file, seconds) pairs.
+        """
+        pages = sorted(self.pages.iteritems(),
+                       key=lambda (page, s): (-s['time'], page))
+        return [(page, s['time']) for page, s in pages[:n or self.SLOWEST]]
+
+    def report(self):
+        return {
+            'total': self.total,
+            'phases': self.phases,
+            'commands': self.commands,
+            'pages': self.pages,
+            'slowest': self.slowest(),
+        }
+
+    def save(self, path):
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.report(), f, indent=1, sort_keys=True)
+        os.rename(tmp, path)
+
+    def summary(self):
+        """
+        the time of each phase and the slowest pages, as text.
+        """
+        lines = ['total {:10.1f} ms'.format(self.total * 1000)]
+        for phase in sorted(self.phases,
+                            key=lambda p: -self.phases[p]['time']):
+            s = self.phases[phase]
+            lines.append('{:<10} {:10.1f} ms {:8d} calls'.format(
+                phase, s['time'] * 1000, s['calls']))
+        if self.pages:
+            lines.append('slowest pages:')
+            for page, elapsed in self.slowest():
+                lines.append('  {:10.1f} ms  {}'.format(elapsed * 1000, page))
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,164 @@
+# coding=utf8
+import os
+import json
+
+from .utils import file_hash, file_stat
+
+def _native(data):
+    """
+    json gives back unicode, turn it into the utf8 strings a fresh build 
+    reads from markdown files and file names.
+    """
+    if isinstance(data, unicode):
+        return data.encode('utf8')
+    if isinstance(data, list):
+        return [_native(v) for v in data]
+    if isinstance(data, dict):
+        return dict((_native(k), _native(v)) for k, v in data.iteritems())
+    return data
+
+class Manifest(object):
+    """
+    persistent record of the last build, used to skip unchanged sources.
+
+    each markdown source is recorded under its `input_file` with:
+        - size, mtime and hash of its contents
+        - the meta produced by preprocessing it
+        - the files generated from it
+
+    a source is considered unchanged if its size and mtime still match, or
+    failing that, if its contents still hash to the same value. the same
+    goes for the other files pages depend on (templates, partials, toc),
+    tracked in `files` and linked to pages through `graph`.
+    """
+
+    VERSION = 2
+
+    def __init__(self, path):
+        self.path = path
+        self.sources = {}
+        self.files = {}
+        self.graph = {}
+        self.pages = None
+        self.renderer = None
+        # current state of files, computed once per build
+        self._current = {}
+        # json of the manifest as last loaded or saved
+        self._saved = None
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path, 'r') as f:
+                saved = f.read()
+            data = _native(json.loads(saved))
+        except (IOError, ValueError):
+            return
+        if data.get('version')!=self.VERSION:
+            # unknown format, start from scratch
+            return
+        self.sources = data.get('sources', {})
+        self.files = data.get('files', {})
+        self.graph = data.get('graph', {})
+        self.pages = data.get('pages')
+        self.renderer = data.get('renderer')
+        self._saved = saved
+
+    def save(self):
+        data = dict(version=self.VERSION, sources=self.sources, 
+                    files=self.files, graph=self.graph, pages=self.pages,
+                    renderer=self.renderer)
+        # dumps goes through the c encoder, dump doesn't
+        data = json.dumps(data)
+        if data==self._saved:
+            # nothing changed, e.g. a no-change build
+            return
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            f.write(data)
+        os.rename(tmp, self.path)
+        self._saved = data
+
+    def source_changed(self, filename):
+        record = self.sources.get(os.path.basename(filename))
+        if not record:
+            return True
+        stat = file_stat(filename)
+        if stat is None:
+            return True
+        if stat==[record['size'], record['mtime']]:
+            return False
+        if file_hash(filename)!=record['hash']:
+            return True
+        # touched but not modified, remember the new stat
+        record['size'], record['mtime'] = stat
+        return False
+
+    def restore(self, filename):
+        """
+        return the recorded meta of `filename` if neither it nor its outputs
+        changed since the last build, otherwise None.
+        """
+        if self.source_changed(filename):
+            return None
+        record = self.sources[os.path.basename(filename)]
+        for output in record['outputs']:
+            if not os.path.isfile(output):
+                return None
+        return record['meta']
+
+    def record(self, filename, meta, outputs):
+        size, mtime = file_stat(filename)
+        self.sources[os.path.basename(filename)] = dict(
+            size=size, mtime=mtime, hash=file_hash(filename), meta=meta, 
+            outputs=list(outputs))
+
+    def add_output(self, input_file, output):
+        record = self.sources.get(input_file)
+        if record is not None and output not in record['outputs']:
+            record['outputs'].append(output)
+
+    def reset_checks(self):
+        """
+        forget the state of files seen so far, e.g. between two builds.
+        """
+        self._current = {}
+
+    def _state(self, path):
+        if path not in self._current:
+            stat = file_stat(path)
+            recorded = self.files.get(path)
+            if stat is None:
+                state = None
+            elif recorded and stat==recorded[:2]:
+                state = recorded
+            else:
+                state = stat + [file_hash(path)]
+            self._current[path] = state
+        return self._current[path]
+
+    def file_changed(self, path):
+        state = self._state(path)
+        recorded = self.files.get(path)
+        return state is None or recorded is None or state[2]!=recorded[2]
+
+    def record_file(self, path):
+        state = self._state(path)
+        if state is not None:
+            self.files[path] = state
+
+    def prune_files(self, paths):
+        """
+        only keep track of `paths`.
+        """
+        for path in list(self.files):
+            if path not in paths:
+                del self.files[path]
+
+    def prune(self, input_files):
+        """
+        forget sources that are no longer part of the book.
+        """
+        for input_file in list(self.sources):
+            if input_file not in input_files:
+                del self.sources[input_file]
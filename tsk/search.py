@@ -0,0 +1,193 @@
+# coding=utf8
+"""
+full-text search index of the book, written at build time for a search
+box to query in the browser.
+
+the index lives in a directory of WEB_PAGES_PATH:
+
+    docs.json           {"prefix_length": 2,
+                         "docs": {"<id>": {"url": ..., "title": ...,
+                                           "sections": [...], "path": [...]}}}
+    terms/<prefix>.json {"<term>": [[<id>, <count>], ...]}
+
+terms are lowercased words, sharded by their first `prefix_length`
+characters (url quoted utf8) so that a query only loads the shards of its
+terms. `path` holds the titles of the toc entries above the page and
+`sections` the ones below it.
+
+updates are incremental: the terms of each page are kept in a state file
+outside of WEB_PAGES_PATH, and only the shards of terms added to, removed
+from or counted differently in a page are written again.
+"""
+import os
+import re
+import json
+import urllib
+import collections
+from HTMLParser import HTMLParser
+
+# markup left out of the text of pages: html tags and the jinja tags the
+# rendered markdown may hold, e.g. included partials
+TAGS = re.compile(r'<[^>]*>|\{%.*?%\}|\{\{.*?\}\}|\{#.*?#\}', re.S)
+WORDS = re.compile(r'\w+', re.U)
+
+_parser = HTMLParser()
+
+def tokenize(html):
+    """
+    count of each term in the text of `html`.
+    """
+    if not isinstance(html, unicode):
+        html = html.decode('utf8')
+    text = _parser.unescape(TAGS.sub(' ', html)).lower()
+    return collections.Counter(
+        w for w in WORDS.findall(text) if len(w) > 1 or w.isdigit())
+
+
+class SearchIndex(object):
+    """
+    `write(path, data)` writes the files of the index, e.g. the generator's
+    `write_output`.
+    """
+
+    VERSION = 1
+
+    def __init__(self, directory, state_file, prefix_length=2, write=None):
+        self.directory = directory
+        self.state_file = state_file
+        self.prefix_length = prefix_length
+        self.write = write or self._write
+        # per page: id, doc and {term: count}
+        self.pages = {}
+        self.next_id = 0
+        # pages changed since the last save, and shards of their terms
+        # added, removed or counted differently
+        self._stale = set()
+        self._dirty = set()
+        # without a state, shards left by an earlier build can't be trusted
+        self._rebuild = True
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.state_file, 'r') as f:
+                data = json.load(f)
+        except (IOError, ValueError):
+            return
+        if (data.get('version')!=self.VERSION or
+                data.get('prefix_length')!=self.prefix_length or
+                not os.path.exists(self._docs_path())):
+            # written for another layout, or the index itself is gone
+            return
+        self.pages = dict((page.encode('utf8'), entry)
+                          for page, entry in data['pages'].iteritems())
+        self.next_id = data['next_id']
+        self._rebuild = False
+
+    def shard(self, term):
+        return urllib.quote(term[:self.prefix_length].encode('utf8'), safe='')
+
+    def _docs_path(self):
+        return os.path.join(self.directory, 'docs.json')
+
+    def _shard_path(self, shard):
+        return os.path.join(self.directory, 'terms', shard + '.json')
+
+    def update(self, page, doc, html):
+        """
+        index the text of `html` for `page`, described by `doc`.
+        """
+        terms = dict(tokenize(html))
+        # in the form it's loaded back
+        doc = json.loads(json.dumps(doc))
+        entry = self.pages.get(page)
+        if entry and entry['doc']==doc and entry['terms']==terms:
+            return
+        if entry is None:
+            entry = self.pages[page] = {'id': self.next_id, 'terms': {}}
+            self.next_id += 1
+        old = entry['terms']
+        self._stale.add(entry['id'])
+        # shards of the terms whose count changed
+        self._dirty.update(self.shard(t) for t in set(old) | set(terms)
+                           if old.get(t)!=terms.get(t))
+        entry['doc'] = doc
+        entry['terms'] = terms
+
+    def remove(self, page):
+        entry = self.pages.pop(page, None)
+        if entry:
+            self._stale.add(entry['id'])
+            self._dirty.update(self.shard(t) for t in entry['terms'])
+
+    def prune(self, pages):
+        """
+        remove the pages not in `pages`.
+        """
+        for page in set(self.pages) - set(pages):
+            self.remove(page)
+
+    def save(self):
+        """
+        write the docs and the shards changed since the last save.
+        """
+        if not self._stale:
+            return
+        terms_dir = os.path.join(self.directory, 'terms')
+        if not os.path.isdir(terms_dir):
+            os.makedirs(terms_dir)
+        elif self._rebuild:
+            for name in os.listdir(terms_dir):
+                os.remove(os.path.join(terms_dir, name))
+        self._rebuild = False
+        postings = collections.defaultdict(list)
+        for page, entry in self.pages.iteritems():
+            if entry['id'] in self._stale:
+                for term, count in entry['terms'].iteritems():
+                    postings[self.shard(term)].append(
+                        (term, entry['id'], count))
+        for shard in self._dirty:
+            self._save_shard(shard, postings.get(shard, []))
+        docs = dict((entry['id'], entry['doc'])
+                    for entry in self.pages.itervalues())
+        self.write(self._docs_path(), json.dumps(
+            {'prefix_length': self.prefix_length, 'docs': docs},
+            sort_keys=True, separators=(',', ':'), ensure_ascii=False))
+        self._stale = set()
+        self._dirty = set()
+        tmp = self.state_file + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'version': self.VERSION, 'next_id': self.next_id,
+                       'prefix_length': self.prefix_length,
+                       'pages': self.pages}, f)
+        os.rename(tmp, self.state_file)
+
+    def _save_shard(self, shard, postings):
+        """
+        rewrite `shard` with `postings` replacing those of stale pages.
+        """
+        path = self._shard_path(shard)
+        try:
+            with open(path, 'r') as f:
+                terms = json.load(f)
+        except (IOError, ValueError):
+            terms = {}
+        for term in terms.keys():
+            terms[term] = [p for p in terms[term] if p[0] not in self._stale]
+        for term, i, count in postings:
+            terms.setdefault(term, []).append([i, count])
+        terms = dict((t, sorted(p)) for t, p in terms.iteritems() if p)
+        if not terms:
+            if os.path.exists(path):
+                os.remove(path)
+            return
+        self.write(path, json.dumps(terms, sort_keys=True,
+                                    separators=(',', ':'),
+                                    ensure_ascii=False))
+
+    @staticmethod
+    def _write(path, data):
+        if isinstance(data, unicode):
+            data = data.encode('utf8')
+        with open(path, 'w') as f:
+            f.write(data)
@@ -0,0 +1,163 @@
+# coding=utf8
+import os
+import json
+import mock
+
+from tsk.admin import create_app
+from tsk.generator import Generator, tsk_command_include
+from tsk.tests.test_generator import BookTestCase
+
+class PreviewTest(BookTestCase):
+
+    def setUp(self):
+        super(PreviewTest, self).setUp()
+        self.write('markdown/toc.md', 'One\nTwo')
+        self.write('templates/main.html', '{% for c in toc.children %}'
+                   '[{{ c.url }}]{% endfor %}'
+                   '<main>{% include contents_template %}</main>')
+        self.write('markdown/one.md', '---\ntitle: One\n---\nfirst chapter')
+
+    def app(self, **config):
+        g = Generator(dict(self.config, TOC_FILE='toc.md', **config))
+        g.register_command(tsk_command_include)
+        app = create_app('tsk', generator=g)
+        # sources are looked at on every request
+        app.extensions['tsk_preview'].catalog.SYNC_INTERVAL = 0
+        return app.test_client()
+
+    def touch(self, path, contents):
+        # a later mtime, whatever the resolution of the filesystem
+        path = os.path.join(self.root, path)
+        mtime = os.stat(path).st_mtime
+        self.write(path, contents)
+        os.utime(path, (mtime + 10, mtime + 10))
+
+    def test_pages_are_rendered_without_a_build(self):
+        r = self.app().get('/one.html')
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(r.data, '[one.html][two.html]'
+                                 '<main><p>first chapter</p></main>')
+        self.assertEqual(os.listdir(self.config['WEB_PAGES_PATH']), [])
+        self.assertEqual(os.listdir(self.config['MARKDOWN_OUTPUT_DIR']), [])
+
+    def test_other_files_are_served_from_web_pages_path(self):
+        self.write('website/style.css', 'body {}')
+        client = self.app()
+        self.assertEqual(client.get('/style.css').data, 'body {}')
+        self.assertEqual(client.get('/three.html').status_code, 404)
+
+    def test_conditional_get_with_strong_etag(self):
+        client = self.app()
+        r = client.get('/one.html')
+        etag = r.headers['ETag']
+        self.assertFalse(etag.startswith('W/'))
+        r = client.get('/one.html', headers={'If-None-Match': etag})
+        self.assertEqual(r.status_code, 304)
+        self.assertEqual(r.data, '')
+
+    def test_unchanged_pages_are_served_from_the_cache(self):
+        client = self.app()
+        client.get('/one.html')
+        with mock.patch.object(Generator, 'render_jinja_template') as mk_render:
+            r = client.get('/one.html')
+        self.assertFalse(mk_render.called)
+        self.assertEqual(r.status_code, 200)
+
+    def test_source_change_renders_the_page_again(self):
+        client = self.app()
+        etag = client.get('/one.html').headers['ETag']
+        self.touch('markdown/one.md', '---\ntitle: One\n---\nfirst, fixed')
+        r = client.get('/one.html', headers={'If-None-Match': etag})
+        self.assertEqual(r.status_code, 200)
+        self.assertTrue('<p>first, fixed</p>' in r.data)
+
+    def test_template_and_partial_changes_render_the_page_again(self):
+        self.write('markdown/partials/chart.html', '<svg>1</svg>')
+        self.write('markdown/two.md', 'second chapter\n$$ include chart.html')
+        client = self.app()
+        client.get('/two.html')
+        self.touch('markdown/partials/chart.html', '<svg>2</svg>')
+        self.assertTrue('<svg>2</svg>' in client.get('/two.html').data)
+        self.touch('templates/main.html',
+                   '<body>{% include contents_template %}</body>')
+        self.assertTrue(client.get('/two.html').data.startswith('<body>'))
+
+    def test_toc_change_renders_the_page_again(self):
+        client = self.app()
+        client.get('/one.html')
+        self.write('markdown/three.md', 'third chapter')
+        self.touch('markdown/toc.md', 'One\nTwo\nThree')
+        self.assertTrue(client.get('/one.html').data.startswith(
+            '[one.html][two.html][three.html]'))
+
+    def test_renamed_pages_move_to_their_new_url(self):
+        client = self.app()
+        client.get('/one.html')
+        self.touch('markdown/one.md', '---\ntitle: Uno\n---\nfirst chapter')
+        self.assertEqual(client.get('/one.html').status_code, 404)
+        self.assertEqual(client.get('/uno.html').status_code, 200)
+
+    def test_cache_is_bounded(self):
+        client = self.app(PREVIEW_CACHE_SIZE=1)
+        client.get('/one.html')
+        client.get('/two.html')
+        preview = client.application.extensions['tsk_preview']
+        self.assertEqual(list(preview.pages), ['two.html'])
+
+
+class AdminPagesTest(BookTestCase):
+
+    def setUp(self):
+        super(AdminPagesTest, self).setUp()
+        for i in xrange(5):
+            self.write('markdown/chapter-{}.md'.format(i), 
+                       '---\ntitle: Chapter {}\npart: {}\n---\ntext'.format(
+                           i, i % 2))
+        app = create_app('tsk', generator=Generator(self.config))
+        app.extensions['tsk_preview'].catalog.SYNC_INTERVAL = 0
+        self.client = app.test_client()
+
+    def get_json(self, url):
+        r = self.client.get(url)
+        self.assertEqual(r.status_code, 200)
+        return json.loads(r.data)
+
+    def test_listing_is_filtered_sorted_and_paginated(self):
+        data = self.get_json('/admin/pages?part=1&sort=-title&per_page=1')
+        self.assertEqual((data['total'], data['page'], data['per_page']), 
+                         (2, 1, 1))
+        self.assertEqual([p['title'] for p in data['pages']], ['Chapter 3'])
+        data = self.get_json('/admin/pages?part=1&sort=-title&per_page=1'
+                             '&page=2')
+        self.assertEqual([p['title'] for p in data['pages']], ['Chapter 1'])
+        self.assertEqual(self.get_json('/admin/pages')['total'], 7)
+
+    def test_sources_are_added_edited_and_deleted(self):
+        r = self.client.put('/admin/pages/new.md', 
+                            data='---\ntitle: New\n---\nnew chapter')
+        self.assertEqual(r.status_code, 201)
+        self.assertEqual(json.loads(r.data)['output_file'], 'new.html')
+        self.assertEqual(self.get_json('/admin/pages?title=New')['total'], 1)
+        self.assertEqual(self.client.get('/new.html').status_code, 200)
+
+        r = self.client.put('/admin/pages/new.md', 
+                            data='---\ntitle: Renamed\n---\nnew chapter')
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(self.get_json('/admin/pages/new.md')['source'], 
+                         '---\ntitle: Renamed\n---\nnew chapter')
+        self.assertEqual(self.get_json('/admin/pages?title=New')['total'], 0)
+
+        self.assertEqual(self.client.delete('/admin/pages/new.md').status_code,
+                         204)
+        self.assertEqual(self.client.get('/admin/pages/new.md').status_code, 
+                         404)
+        self.assertEqual(self.get_json('/admin/pages')['total'], 7)
+
+    def test_only_sources_of_markdown_path_are_managed(self):
+        for name in ['notes.txt', '.hidden.md']:
+            r = self.client.put('/admin/pages/' + name, data='x')
+            self.assertEqual(r.status_code, 400)
+        r = self.client.delete('/admin/pages/..%2Fmarkdown%2Fone.md')
+        self.assertTrue(r.status_code >= 400)
+        self.assertTrue(os.path.exists(os.path.join(self.root, 
+                                                    'markdown/one.md')))
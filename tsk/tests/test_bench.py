@@ -0,0 +1,62 @@
+# coding=utf8
+import os
+import sys
+import shutil
+import tempfile
+import subprocess
+import unittest
+
+from tsk import bench
+
+class SyntheticBookTest(unittest.TestCase):
+
+    def setUp(self):
+        super(SyntheticBookTest, self).setUp()
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+        super(SyntheticBookTest, self).tearDown()
+
+    def test_book_builds(self):
+        bench.synthetic_book(self.root, chapters=3, paragraphs=2,
+                             toc_depth=3, includes=2, meta_lines=4)
+        g = bench.book_generator(self.root)
+        g.build()
+        self.assertEqual(sorted(g.book),
+                         ['chapter-0.html', 'chapter-1.html', 'chapter-2.html'])
+        self.assertEqual(len(g.book['chapter-1.html']['dependencies']), 2)
+        self.assertEqual(len(g.toc_index.entries), 3 * (1 + 2 * 2))
+        with open(os.path.join(self.root, 'website', 'chapter-1.html')) as f:
+            html = f.read()
+        self.assertIn('<table>', html)
+        self.assertIn('<a href="chapter-2.html">Chapter 2</a>', html)
+
+    def test_toc_depth_is_bounded(self):
+        with self.assertRaises(ValueError):
+            bench.synthetic_book(self.root, toc_depth=6)
+
+
+class CompareTest(unittest.TestCase):
+
+    def test_slowdowns_beyond_threshold_are_flagged(self):
+        baseline = {'render': 1.0, 'toc': 1.0, 'build': 2.0}
+        results = {'render': 1.2, 'toc': 1.05, 'build': 1.5, 'new': 1.0}
+        self.assertEqual(bench.compare(baseline, results, threshold=0.1),
+                         [('render', 1.0, 1.2)])
+
+
+class StartupTest(unittest.TestCase):
+
+    def test_import_leaves_heavy_dependencies_out(self):
+        imported = subprocess.check_output([sys.executable, '-c', 
+            'import sys, tsk, tsk.cli; '
+            'print " ".join(sorted(set(m.split(".")[0] for m in sys.modules)))'
+        ]).split()
+        for name in ['flask', 'jinja2', 'markdown', 'slugify']:
+            self.assertNotIn(name, imported)
+
+    def test_startup_is_timed(self):
+        results = bench.bench_startup(chapters=2, repeat=1)
+        self.assertEqual(sorted(results), 
+                         ['import tsk', 'no-change build', 'python'])
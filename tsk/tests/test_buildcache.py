@@ -0,0 +1,88 @@
+# coding=utf8
+import os
+import shutil
+import tempfile
+import mock
+
+from tsk.buildcache import BuildCache
+from tsk.generator import Generator
+from tsk.tests.test_generator import BookTestCase
+
+class BuildCacheTest(BookTestCase):
+
+    def setUp(self):
+        super(BuildCacheTest, self).setUp()
+        self.cache_dir = tempfile.mkdtemp()
+        self.cache = os.path.join(self.cache_dir, 'cache.sqlite')
+        self.write('markdown/partials/chart.html', '<svg></svg>')
+        self.write('markdown/two.md', 'second\n$$ include chart.html')
+        self.write('markdown/toc.md', 'One\nTwo')
+        self.write('templates/main.html', '{% for e in toc.children %}'
+                   '{{ e.url }} {% endfor %}{% include contents_template %}')
+        self.config.update(BUILD_CACHE=self.cache, TOC_FILE='toc.md')
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+        super(BuildCacheTest, self).tearDown()
+
+    def checkout(self):
+        """
+        the same book at another place, without its outputs.
+        """
+        root = tempfile.mkdtemp()
+        for d in ['markdown', 'templates']:
+            shutil.copytree(os.path.join(self.root, d), os.path.join(root, d))
+        shutil.rmtree(os.path.join(root, 'templates', 'pages'))
+        shutil.rmtree(os.path.join(root, 'templates', 'partials'))
+        os.makedirs(os.path.join(root, 'templates', 'pages'))
+        os.makedirs(os.path.join(root, 'website'))
+        self.root, old = root, self.root
+        self.addCleanup(shutil.rmtree, old)
+        for k, v in self.config.items():
+            if isinstance(v, str) and v.startswith(old):
+                self.config[k] = root + v[len(old):]
+
+    def rendered(self):
+        with mock.patch.object(Generator, 'render_markdown', autospec=True,
+                               side_effect=Generator.render_markdown) as mk_md:
+            with mock.patch.object(
+                    Generator, 'render_jinja_template', autospec=True, 
+                    side_effect=Generator.render_jinja_template) as mk_page:
+                self.build()
+        return mk_md.call_count, mk_page.call_count
+
+    def test_other_checkout_reuses_the_cache(self):
+        self.build()
+        expected = self.read('website/two.html')
+        self.checkout()
+        self.assertEqual(self.rendered(), (0, 0))
+        self.assertEqual(self.read('website/two.html'), expected)
+        self.assertEqual(self.read('templates/partials/chart.html'), 
+                         '<svg></svg>')
+
+    def test_changes_are_rendered_again(self):
+        self.build()
+        self.checkout()
+        self.write('markdown/one.md', 'first chapter, fixed')
+        self.assertEqual(self.rendered(), (1, 1))
+        self.write('markdown/partials/chart.html', '<svg>!</svg>')
+        self.assertEqual(self.rendered(), (1, 1))
+        self.write('templates/main.html', '{% include contents_template %}')
+        self.assertEqual(self.rendered(), (0, 2))
+        self.assertEqual(self.read('website/two.html'), 
+                         '<p>second\n<svg>!</svg></p>')
+
+    def test_toc_changes_render_pages_again(self):
+        self.build()
+        self.write('markdown/three.md', 'third')
+        self.assertEqual(self.rendered(), (1, 3))
+
+    def test_unused_entries_are_dropped(self):
+        self.build(BUILD_CACHE_KEEP=2)
+        self.write('markdown/one.md', 'first chapter, fixed')
+        self.build(BUILD_CACHE_KEEP=2)
+        self.build(BUILD_CACHE_KEEP=2)
+        cache = BuildCache(self.cache)
+        # 2 sources and 2 pages, one of each for the previous one.md
+        self.assertEqual(cache.db.execute(
+            'SELECT COUNT(*) FROM entries').fetchone()[0], 4)
@@ -0,0 +1,50 @@
+# coding=utf8
+import os
+import shutil
+import tempfile
+import unittest
+
+from tsk.cache import CommandCache
+
+class CommandCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        super(CommandCacheTest, self).setUp()
+        self.root = tempfile.mkdtemp()
+        self.path = os.path.join(self.root, 'commands.json')
+        self.states = lambda paths: [[1, 2.5] for p in paths]
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+        super(CommandCacheTest, self).tearDown()
+
+    def test_entries_are_checked_against_file_states(self):
+        cache = CommandCache()
+        cache.set('k', 'result', [('a.csv', [1, 2.5])])
+        self.assertEqual(cache.get('k', self.states)[0], 'result')
+        self.assertIsNone(cache.get('k', lambda paths: [None]))
+
+    def test_least_recently_used_entries_are_evicted(self):
+        cache = CommandCache(size=2)
+        cache.set('a', '1', [])
+        cache.set('b', '2', [])
+        cache.get('a', self.states)
+        cache.set('c', '3', [])
+        self.assertEqual(list(cache.entries), ['a', 'c'])
+
+    def test_entries_are_kept_between_builds(self):
+        cache = CommandCache(self.path)
+        cache.set('k', u'résultat', [('a.csv', [1, 2.5])])
+        cache.save()
+        cache = CommandCache(self.path, size=1)
+        self.assertEqual(cache.get('k', self.states)[0], 'résultat')
+        self.assertEqual(cache.get('k', self.states)[1], [['a.csv', [1, 2.5]]])
+
+    def test_added_entries_are_only_tracked_on_demand(self):
+        cache = CommandCache()
+        cache.set('a', '1', [])
+        self.assertIsNone(cache.added)
+        cache.added = {}
+        cache.set('b', '2', [])
+        self.assertEqual(cache.take_added(), {'b': ['2', []]})
+        self.assertEqual(cache.take_added(), {})
@@ -0,0 +1,94 @@
+# coding=utf8
+import os
+import mock
+
+from tsk.catalog import Catalog
+from tsk.generator import Generator
+from tsk.tests.test_generator import BookTestCase
+
+class CatalogTest(BookTestCase):
+
+    def setUp(self):
+        super(CatalogTest, self).setUp()
+        self.write('markdown/one.md', 
+                   '---\ntitle: Zebra\npart: 2\ntags: a\n---\nfirst chapter')
+        self.write('markdown/two.md', 
+                   '---\ntitle: Apple\npart: 10\ntags: a\ntags: b\n'
+                   'template: wide.html\n---\n$$ missing\n')
+        self.write('markdown/three.md', 'third chapter')
+        self.path = os.path.join(self.root, 'catalog.sqlite')
+        self.catalog = self.open()
+
+    def tearDown(self):
+        self.catalog.close()
+        super(CatalogTest, self).tearDown()
+
+    def open(self):
+        catalog = Catalog(Generator(self.config), self.path)
+        catalog.SYNC_INTERVAL = 0
+        catalog.sync()
+        return catalog
+
+    def files(self, **kwargs):
+        total, pages = self.catalog.query(**kwargs)
+        return total, [p['input_file'] for p in pages]
+
+    def touch(self, path, contents):
+        path = os.path.join(self.root, path)
+        mtime = os.stat(path).st_mtime
+        self.write(path, contents)
+        os.utime(path, (mtime + 10, mtime + 10))
+
+    def test_columns_and_meta_are_catalogued(self):
+        total, pages = self.catalog.query({'input_file': 'two.md'})
+        self.assertEqual(total, 1)
+        page = pages[0]
+        self.assertEqual((page['output_file'], page['title'], 
+                          page['template']),
+                         ('apple.html', 'Apple', 'wide.html'))
+        self.assertEqual(page['meta']['tags'], ['a', 'b'])
+        self.assertEqual(self.catalog.book()['zebra.html']['part'], [2])
+
+    def test_filters_on_columns_and_meta_keys(self):
+        self.assertEqual(self.files(filters={'template': 'main.html'}),
+                         (2, ['one.md', 'three.md']))
+        self.assertEqual(self.files(filters={'tags': 'b'}), (1, ['two.md']))
+        self.assertEqual(self.files(filters={'tags': 'a', 'part': 2}), 
+                         (1, ['one.md']))
+
+    def test_sort_and_pages(self):
+        self.assertEqual(self.files(sort='title', limit=2), 
+                         (3, ['three.md', 'two.md']))
+        self.assertEqual(self.files(sort='title', offset=2), (3, ['one.md']))
+        # meta values keep their types
+        self.assertEqual(self.files(sort='part', descending=True), 
+                         (3, ['two.md', 'one.md', 'three.md']))
+
+    def test_only_changed_sources_are_read_again(self):
+        self.touch('markdown/one.md', '---\ntitle: Yak\n---\n')
+        os.remove(os.path.join(self.root, 'markdown/three.md'))
+        self.catalog.close()
+        with mock.patch.object(Generator, 'read_markdown_meta', autospec=True,
+                               side_effect=Generator.read_markdown_meta
+                              ) as mk_read:
+            self.catalog = self.open()
+        self.assertEqual(mk_read.call_count, 1)
+        self.assertEqual(self.files(sort='title'), (2, ['two.md', 'one.md']))
+        self.assertEqual(self.files(filters={'part': 2}), (0, []))
+
+    def test_refresh_follows_the_files_given(self):
+        self.write('markdown/four.md', '---\ntitle: Four\n---\n')
+        os.remove(os.path.join(self.root, 'markdown/one.md'))
+        changed = self.catalog.refresh([
+            os.path.join(self.root, p) for p in 
+            ['markdown/four.md', 'markdown/one.md', 'templates/main.html']])
+        self.assertEqual(changed, set(['four.md', 'one.md']))
+        self.assertEqual(sorted(self.catalog.book()), 
+                         ['apple.html', 'four.html', 'three.html'])
+
+    def test_sync_is_throttled(self):
+        self.catalog.SYNC_INTERVAL = 60
+        self.catalog.sync(force=True)
+        self.write('markdown/four.md', 'fourth chapter')
+        self.assertEqual(self.catalog.sync(), set())
+        self.assertEqual(self.catalog.sync(force=True), set(['four.md']))
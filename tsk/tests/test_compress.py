@@ -0,0 +1,72 @@
+# coding=utf8
+import os
+import gzip
+import unittest
+import mock
+
+from tsk import compress
+from tsk.compress import Compressor
+from tsk.generator import Generator, TskError
+from tsk.tests.test_generator import BookTestCase
+
+class CompressTest(BookTestCase):
+
+    def sidecar(self, name):
+        return os.path.join(self.config['WEB_PAGES_PATH'], name)
+
+    def test_sidecars_are_written_next_to_pages(self):
+        self.build(COMPRESS=('gz',))
+        with gzip.open(self.sidecar('one.html.gz')) as f:
+            self.assertEqual(f.read(), '<main><p>first chapter</p></main>')
+        self.assertAlmostEqual(os.stat(self.sidecar('one.html.gz')).st_mtime,
+                               os.stat(self.sidecar('one.html')).st_mtime, 
+                               places=5)
+
+    def test_unchanged_pages_are_not_compressed_again(self):
+        self.build(COMPRESS=('gz',))
+        self.write('markdown/two.md', 'second chapter, fixed')
+        with mock.patch.object(Compressor, 'compress_file',
+                               autospec=True) as mk_compress:
+            self.build(COMPRESS=('gz',))
+        self.assertEqual(mk_compress.call_count, 1)
+        self.assertTrue(mk_compress.call_args[0][1].endswith('two.html'))
+
+    def test_other_files_of_web_pages_path_are_compressed(self):
+        self.write('website/style.css', 'body {}')
+        self.write('website/logo.png', 'png')
+        self.build(COMPRESS=('gz',))
+        self.assertTrue(os.path.exists(self.sidecar('style.css.gz')))
+        self.assertFalse(os.path.exists(self.sidecar('logo.png.gz')))
+
+    def test_sidecars_of_removed_files_are_removed(self):
+        self.write('website/style.css', 'body {}')
+        self.write('website/archive.gz', 'kept')
+        self.build(COMPRESS=('gz',))
+        os.remove(self.sidecar('style.css'))
+        self.build(COMPRESS=('gz',))
+        self.assertFalse(os.path.exists(self.sidecar('style.css.gz')))
+        self.assertTrue(os.path.exists(self.sidecar('archive.gz')))
+
+    def test_level_is_configurable(self):
+        self.write('markdown/one.md', 'some text ' * 1000)
+        self.build(COMPRESS=('gz',), COMPRESS_LEVELS={'gz': 1})
+        fast = os.path.getsize(self.sidecar('one.html.gz'))
+        os.remove(self.sidecar('one.html.gz'))
+        self.build(COMPRESS=('gz',))
+        self.assertTrue(os.path.getsize(self.sidecar('one.html.gz')) < fast)
+
+    def test_unknown_format_raises(self):
+        with self.assertRaises(TskError):
+            Generator(dict(self.config, COMPRESS=('zip',)))
+
+    @unittest.skipIf(compress.brotli is None, 'brotli is not installed')
+    def test_brotli_sidecars(self):
+        self.build(COMPRESS=('gz', 'br'), COMPRESS_THREADS=1)
+        with open(self.sidecar('one.html.br'), 'rb') as f:
+            self.assertEqual(compress.brotli.decompress(f.read()),
+                             '<main><p>first chapter</p></main>')
+
+    def test_missing_brotli_raises(self):
+        with mock.patch.object(compress, 'brotli', None):
+            with self.assertRaises(TskError):
+                Generator(dict(self.config, COMPRESS=('br',)))
@@ -1,11 +1,19 @@
 # coding=utf8
+import os
+import shutil
+import tempfile
 import unittest 
 import mock
 import StringIO
+import time
 
 import jinja2
 
-from tsk.generator import slugify, Generator, TskError, TOC, markdown
+import tsk.utils
+
+from tsk.generator import (slugify, Generator, TskError, TOC, markdown,
+                           bound_command, memoized_command, concurrent_command,
+                           tsk_command_include)
 
 class GeneratorTest(unittest.TestCase):
 
@@ -59,9 +67,12 @@ class GeneratorTest(unittest.TestCase):
         # all required configs set
         Generator(self.config)
 
-    @mock.patch('tsk.generator.Environment')
+    @mock.patch('tsk.generator.jinja2.Environment')
     def test_jinja_environment_instance_created(self, Environ):
         g = Generator(self.config)
+        Environ.assert_not_called()
+        g.jinja_environ
+        g.jinja_environ
         Environ.assert_called_once()
         # assert instance of jinja2.FileSystemLoader
         self.assertTrue(isinstance(Environ.call_args[1]['loader'], 
@@ -84,6 +95,26 @@ class GeneratorTest(unittest.TestCase):
             g.render_markdown(markdown_text)
             mkconvert.assert_called_once_with(side_effect.self, markdown_text)
 
+    def test_markdown_converter_is_reused_between_renders(self):
+        g = Generator(self.config)
+        with mock.patch('tsk.generator.markdown.Markdown', 
+                        wraps=markdown.Markdown) as mk_markdown:
+            g.render_markdown('one')
+            g.render_markdown('two')
+        mk_markdown.assert_called_once()
+
+    def test_markdown_converter_uses_configured_extensions(self):
+        config = dict(self.config, 
+                      MARKDOWN_EXTENSIONS=['markdown.extensions.toc'],
+                      MARKDOWN_EXTENSION_CONFIGS={
+                          'markdown.extensions.toc': {'anchorlink': True}})
+        g = Generator(config)
+        html = g.render_markdown('# Title')
+        self.assertTrue('<a class="toclink" href="#title">' in html)
+        # state from the previous document doesn't leak into the next
+        html = g.render_markdown('# Other')
+        self.assertEqual(g.markdown_converter.toc_tokens[0]['id'], 'other')
+
     @mock.patch('__builtin__.open')
     def test_processing_markdown_should_write_contents_output(self, mock_open):
         data = 'some data'
@@ -113,10 +144,24 @@ class GeneratorTest(unittest.TestCase):
             self, mock_exec_command):
         command = 'some_random_cmd'
         text = 'Lorem blabla \n$${}\nIpsum etc'.format(command)
+        mock_exec_command.return_value = ''
         g = Generator(self.config)
         g.preprocess_markdown(text)
         mock_exec_command.assert_called_once_with(command, [])
 
+    def test_markdown_preprocessing_streams_any_line_iterator(self):
+        g = Generator(self.config)
+        def echo(self, *args):
+            return 'cmd:' + ','.join(args) + '\n'
+        g.register_command(echo, bound=True)
+        text = '---\ntitle: T\n---\nline 1\n$$ echo a b\nline 2\n'
+        lines = (l for l in StringIO.StringIO(text))
+        self.assertEqual(g.preprocess_markdown(lines), 
+                         g.preprocess_markdown(text))
+        meta, md = g.preprocess_markdown(text)
+        self.assertEqual(meta, {'title': ['T']})
+        self.assertEqual(md, 'line 1\ncmd:a,b\nline 2\n')
+
     def test_rendering_jinja_template_calls_get_template_method(self):
         g = Generator(self.config)
         with mock.patch.object(g.jinja_environ, 'get_template') as mk_gtmp:
@@ -195,23 +240,29 @@ class GeneratorTest(unittest.TestCase):
         slug = u'agnes-and-tovi'
         self.assertEqual(slugify(text), slug)
 
-    @mock.patch('__builtin__.open')
-    def test_write_output_should_work_with_binary_strings(self, mk_open):
-        mk_open.return_value.__enter__.return_value = mk_open.return_value
+    def test_write_output_should_work_with_binary_strings(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        path = os.path.join(root, 'out.html')
         g = Generator(self.config)
         bin_str = u'some unicode string éà'.encode('utf8')
-        g.write_output(None, bin_str)
-        mk_open.return_value.write.assert_called_with(bin_str)
+        g.write_output(path, bin_str)
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), bin_str)
         bin_str = u'some unicode string éà'.encode('latin1')
-        g.write_output(None, bin_str)
-        mk_open.return_value.write.assert_called_with(bin_str)
-
-    @mock.patch('__builtin__.open')
-    def test_write_output_should_work_with_unicode_strings(self, mk_open):
-        mk_open.return_value.__enter__.return_value = mk_open.return_value
+        g.write_output(path, bin_str)
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), bin_str)
+
+    def test_write_output_should_work_with_unicode_strings(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        path = os.path.join(root, 'out.html')
         g = Generator(self.config)
         uc_str = u'some unicode string éà'
-        g.write_output(None, uc_str)
+        g.write_output(path, uc_str)
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), uc_str.encode('utf8'))
 
     def test_markdown_render_should_work_with_unicode_strings(self):
         uc_str = u'some unicode string éà'
@@ -241,3 +292,612 @@ class GeneratorTest(unittest.TestCase):
         meta = "some \\ \\\\ \, tokens, in this, string"
         tokens = g._tokenize_meta(meta)
         self.assertEqual(tokens, ['some \\ \\\\ , tokens', 'in this', 'string'])
+
+
+class BookTestCase(unittest.TestCase):
+    """
+    base for tests that build a small book in a temporary directory.
+    """
+
+    def setUp(self):
+        super(BookTestCase, self).setUp()
+        self.root = tempfile.mkdtemp()
+        self.config = dict(
+            MARKDOWN_PATH=os.path.join(self.root, 'markdown'),
+            TEMPLATE_PATH=os.path.join(self.root, 'templates'),
+            DEFAULT_TEMPLATE='main.html',
+            MARKDOWN_OUTPUT_DIR=os.path.join(self.root, 'templates', 'pages'),
+            WEB_PAGES_PATH=os.path.join(self.root, 'website'),
+        )
+        for d in ['MARKDOWN_PATH', 'MARKDOWN_OUTPUT_DIR', 'WEB_PAGES_PATH']:
+            os.makedirs(self.config[d])
+        self.write('templates/main.html', 
+                   '<main>{% include contents_template %}</main>')
+        self.write('markdown/one.md', 'first chapter')
+        self.write('markdown/two.md', 'second chapter')
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+        super(BookTestCase, self).tearDown()
+
+    def write(self, path, contents):
+        path = os.path.join(self.root, path)
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write(contents)
+
+    def read(self, path):
+        with open(os.path.join(self.root, path), 'r') as f:
+            return f.read()
+
+    def build(self, **config):
+        c = self.config.copy()
+        c.update(config)
+        track = c.pop('track_dependencies', False)
+        g = Generator(c)
+        g.track_dependencies = g.track_dependencies or track
+        g.register_command(tsk_command_include)
+        g.process_markdown()
+        g.generate_webpages()
+        return g
+
+
+class ReadMarkdownMetaTest(BookTestCase):
+
+    def test_meta_block_is_read_without_running_commands(self):
+        self.write('markdown/one.md', '-#-\n---\nskipped: 1\n---\n-#-\n'
+                   '---\ntitle: First Chapter\npages: 3\n---\n'
+                   '$$ missing_command\n---\nlater: 1\n---\n')
+        g = Generator(self.config)
+        meta = g.read_markdown_meta(os.path.join(self.root, 'markdown/one.md'))
+        self.assertEqual(meta, {
+            'title': ['First Chapter'], 'pages': [3],
+            'input_file': 'one.md', 'output_file': 'first-chapter.html',
+            'output_path': os.path.join(self.config['MARKDOWN_OUTPUT_DIR'],
+                                        'first-chapter.html')})
+
+
+class ScanTest(BookTestCase):
+
+    def test_commands_see_the_whole_book_before_rendering(self):
+        self.write('markdown/toc.md', 'One\nTwo')
+        self.write('markdown/one.md', '$$ pages')
+        self.write('markdown/two.md', '$$ pages')
+        def pages(self):
+            return ','.join(e['url'] for e in self.toc_index.entries)
+        g = Generator(dict(self.config, TOC_FILE='toc.md'))
+        g.register_command(pages, bound=True)
+        g.build()
+        self.assertEqual(self.read('website/one.html'),
+                         '<main><p>one.html,two.html</p></main>')
+        self.assertEqual(self.read('website/two.html'),
+                         '<main><p>one.html,two.html</p></main>')
+
+    def test_toc_answers_from_the_sources_rather_than_old_outputs(self):
+        self.write('markdown/toc.md', 'One\nTwo\nThree')
+        self.write('templates/pages/three.html', 'left by an earlier build')
+        g = Generator(dict(self.config, TOC_FILE='toc.md'))
+        self.assertEqual([e['url'] for e in g.toc_index.entries],
+                         ['one.html', 'two.html', None])
+        self.assertEqual(g.toc_index.entries[1]['markdown'], 'two.md')
+        self.assertEqual(g.book, {})
+
+    def test_pages_named_by_a_later_meta_block_leave_no_trace(self):
+        self.write('markdown/two.md',
+                   '---\ntitle: Two\n---\n---\ntitle: Deux\n---\ntext')
+        g = self.build()
+        self.assertEqual(sorted(g.book), ['one.html', 'twodeux.html'])
+
+    def test_unchanged_sources_are_skipped(self):
+        self.build(INCREMENTAL=True)
+        self.write('markdown/two.md', 'second chapter, fixed')
+        with mock.patch.object(Generator, 'process_markdown_file', 
+                               autospec=True, 
+                               side_effect=Generator.process_markdown_file
+                              ) as mk_process:
+            g = self.build(INCREMENTAL=True)
+        self.assertEqual(mk_process.call_count, 1)
+        self.assertTrue(mk_process.call_args[0][1].endswith('two.md'))
+        self.assertEqual(set(g.book), set(['one.html', 'two.html']))
+        self.assertEqual(self.read('website/two.html'), 
+                         '<main><p>second chapter, fixed</p></main>')
+
+    def test_unchanged_pages_are_not_rendered_again(self):
+        self.build(INCREMENTAL=True)
+        with mock.patch.object(Generator, 'render_jinja_template') as mk_render:
+            self.build(INCREMENTAL=True)
+        self.assertFalse(mk_render.called)
+
+    def test_unchanged_manifest_is_not_written_again(self):
+        g = self.build(INCREMENTAL=True)
+        inode = os.stat(g._manifest_path()).st_ino
+        self.build(INCREMENTAL=True)
+        self.assertEqual(os.stat(g._manifest_path()).st_ino, inode)
+
+    def test_layout_change_renders_all_pages(self):
+        self.build(INCREMENTAL=True)
+        self.write('templates/main.html', 
+                   '<body>{% include contents_template %}</body>')
+        self.build(INCREMENTAL=True)
+        self.assertEqual(self.read('website/one.html'), 
+                         '<body><p>first chapter</p></body>')
+
+    def test_extension_instances_keep_render_signature_stable(self):
+        from markdown.extensions.toc import TocExtension
+        config = lambda: dict(self.config, MARKDOWN_EXTENSIONS=[
+            TocExtension(anchorlink=True)])
+        self.assertEqual(Generator(config())._render_signature(), 
+                         Generator(config())._render_signature())
+        other = dict(self.config, MARKDOWN_EXTENSIONS=[
+            TocExtension(anchorlink=False)])
+        self.assertNotEqual(Generator(config())._render_signature(), 
+                            Generator(other)._render_signature())
+
+    def test_removed_sources_are_dropped_from_manifest(self):
+        g = self.build(INCREMENTAL=True)
+        os.remove(os.path.join(self.config['MARKDOWN_PATH'], 'one.md'))
+        g = self.build(INCREMENTAL=True)
+        self.assertEqual(list(g.book), ['two.html'])
+        self.assertEqual(list(g.manifest.sources), ['two.md'])
+
+
+class ParallelBuildTest(BookTestCase):
+
+    def test_parallel_build_output_identical_to_serial(self):
+        for i in xrange(10):
+            self.write('markdown/chapter-{}.md'.format(i), 
+                       '---\ntitle: Chapter {0}\n---\n# {0}\n\n*text*'.format(i))
+        serial = self.build()
+        pages = dict((f, self.read('website/' + f)) for f in serial.book)
+        shutil.rmtree(self.config['WEB_PAGES_PATH'])
+        os.makedirs(self.config['WEB_PAGES_PATH'])
+
+        parallel = self.build(JOBS=4)
+        self.assertEqual(parallel.book, serial.book)
+        for f, contents in pages.iteritems():
+            self.assertEqual(self.read('website/' + f), contents)
+
+    def test_jobs_argument_overrides_config(self):
+        g = Generator(self.config)
+        with mock.patch.object(g, '_process_markdown_in_pool') as mk_pool:
+            g.process_markdown(jobs=3)
+        mk_pool.assert_called_once_with(mock.ANY, 3)
+
+
+class TemplateCacheTest(BookTestCase):
+
+    def test_precompiling_requires_a_cache_dir(self):
+        g = Generator(self.config)
+        with self.assertRaises(TskError) as a:
+            g.precompile_templates()
+        self.assertTrue(str(a.exception).startswith('JINJA_CACHE_DIR must'))
+
+    def test_precompiled_templates_are_loaded_from_bytecode_cache(self):
+        cache_dir = os.path.join(self.root, 'cache')
+        g = Generator(dict(self.config, JINJA_CACHE_DIR=cache_dir))
+        self.assertEqual(g.precompile_templates(), ['main.html'])
+        self.assertEqual(len(os.listdir(cache_dir)), 1)
+
+        g = Generator(dict(self.config, JINJA_CACHE_DIR=cache_dir))
+        with mock.patch.object(g.jinja_environ, 'compile') as mk_compile:
+            g.jinja_environ.get_template('main.html')
+        self.assertFalse(mk_compile.called)
+
+
+class DependencyGraphTest(BookTestCase):
+
+    def setUp(self):
+        super(DependencyGraphTest, self).setUp()
+        self.write('markdown/partials/chart.html', '<svg>1</svg>')
+        self.write('markdown/two.md', 'second chapter\n$$ include chart.html')
+        self.write('templates/base.html', 
+                   '<main>{% block main %}{% endblock %}</main>')
+        self.write('templates/main.html', '{% extends "base.html" %}'
+                   '{% block main %}{% include contents_template %}'
+                   '{% endblock %}')
+        self.web_file = lambda f: os.path.join(
+            self.config['WEB_PAGES_PATH'], f)
+
+    def test_dependencies_only_recorded_when_used(self):
+        g = self.build()
+        self.assertEqual(g.dependencies.outputs(), set())
+
+    def test_dependencies_recorded_while_building(self):
+        g = self.build(track_dependencies=True)
+        deps = g.dependencies.dependencies(self.web_file('two.html'))
+        for f in ['markdown/two.md', 'markdown/partials/chart.html', 
+                  'templates/main.html', 'templates/base.html']:
+            self.assertTrue(os.path.join(self.root, f) in deps)
+        self.assertEqual(
+            g.affected_outputs(os.path.join(self.root, 'templates/base.html')),
+            set([self.web_file('one.html'), self.web_file('two.html')]))
+        self.assertEqual(
+            g.affected_outputs(os.path.join(self.root, 
+                                            'markdown/partials/chart.html')),
+            set([self.web_file('two.html')]))
+
+    def test_affected_outputs_accept_relative_paths(self):
+        g = self.build(track_dependencies=True)
+        cwd = os.getcwd()
+        os.chdir(self.root)
+        try:
+            affected = g.affected_outputs('markdown/partials/chart.html')
+        finally:
+            os.chdir(cwd)
+        self.assertEqual(affected, set([self.web_file('two.html')]))
+
+    def test_partial_change_only_renders_pages_including_it(self):
+        self.build(INCREMENTAL=True)
+        self.write('markdown/partials/chart.html', '<svg>2</svg>')
+        with mock.patch.object(Generator, 'render_jinja_template', 
+                               autospec=True, 
+                               side_effect=Generator.render_jinja_template
+                              ) as mk_render:
+            self.build(INCREMENTAL=True)
+        self.assertEqual(mk_render.call_count, 1)
+        self.assertEqual(mk_render.call_args[1]['data']['input_file'], 
+                         'two.md')
+        self.assertTrue('<svg>2</svg>' in self.read('website/two.html'))
+
+    def test_toc_change_only_renders_pages_using_it(self):
+        self.write('markdown/toc.md', 'One\nTwo')
+        self.write('templates/toc.html', 
+                   '{% for c in toc.children %}{{ c.title }}{% endfor %}')
+        self.write('markdown/one.md', 
+                   '---\ntemplate: toc.html\n---\nfirst chapter')
+        self.build(INCREMENTAL=True, TOC_FILE='toc.md')
+        self.write('markdown/toc.md', 'One\nTwo\nThree')
+        with mock.patch.object(Generator, 'render_jinja_template', 
+                               return_value='') as mk_render:
+            self.build(INCREMENTAL=True, TOC_FILE='toc.md')
+        self.assertEqual(mk_render.call_count, 1)
+        self.assertEqual(mk_render.call_args[1]['template'], 'toc.html')
+
+
+class InMemoryBuildTest(BookTestCase):
+
+    def test_markdown_output_not_written_in_memory_mode(self):
+        self.write('markdown/partials/chart.html', '<svg></svg>')
+        self.write('markdown/two.md', 'second chapter\n$$ include chart.html')
+        g = self.build(IN_MEMORY=True)
+        self.assertEqual(os.listdir(self.config['MARKDOWN_OUTPUT_DIR']), [])
+        self.assertEqual(self.read('website/one.html'), 
+                         '<main><p>first chapter</p></main>')
+        self.assertEqual(self.read('website/two.html'), 
+                         '<main><p>second chapter\n<svg></svg></p></main>')
+
+    def test_markdown_output_written_for_debugging(self):
+        self.build(IN_MEMORY=True, DEBUG_MARKDOWN_OUTPUT=True)
+        self.assertEqual(self.read('templates/pages/one.html'), 
+                         '<p>first chapter</p>')
+
+    def test_toc_links_to_pages_kept_in_memory(self):
+        self.write('markdown/toc.md', 'One\nTwo')
+        self.write('templates/main.html', '{% for c in toc.children %}'
+                   '[{{ c.title }}|{{ c.url }}]{% endfor %}')
+        self.build(IN_MEMORY=True, TOC_FILE='toc.md')
+        self.assertEqual(self.read('website/one.html'), 
+                         '[One|one.html][Two|two.html]')
+
+    def test_restored_pages_rendered_again_when_layout_changes(self):
+        self.build(IN_MEMORY=True, INCREMENTAL=True)
+        self.write('templates/main.html', 
+                   '<body>{% include contents_template %}</body>')
+        self.build(IN_MEMORY=True, INCREMENTAL=True)
+        self.assertEqual(self.read('website/one.html'), 
+                         '<body><p>first chapter</p></body>')
+
+
+class RebuildTest(BookTestCase):
+
+    def setUp(self):
+        super(RebuildTest, self).setUp()
+        self.write('markdown/partials/chart.html', '<svg>1</svg>')
+        self.write('markdown/two.md', 'second chapter\n$$ include chart.html')
+        self.g = self.build(track_dependencies=True)
+        self.path = lambda f: os.path.join(self.root, f)
+
+    def test_modified_chapter_only_renders_its_page(self):
+        self.write('markdown/one.md', 'first chapter, fixed')
+        pages = self.g.rebuild([self.path('markdown/one.md')])
+        self.assertEqual(pages, set(['one.html']))
+        self.assertEqual(self.read('website/one.html'), 
+                         '<main><p>first chapter, fixed</p></main>')
+
+    def test_modified_partial_renders_pages_including_it(self):
+        self.write('markdown/partials/chart.html', '<svg>2</svg>')
+        pages = self.g.rebuild([self.path('markdown/partials/chart.html')])
+        self.assertEqual(pages, set(['two.html']))
+        self.assertTrue('<svg>2</svg>' in self.read('website/two.html'))
+
+    def test_new_and_deleted_chapters(self):
+        self.write('markdown/three.md', 'third chapter')
+        os.remove(self.path('markdown/one.md'))
+        pages = self.g.rebuild([self.path('markdown/three.md'), 
+                                self.path('markdown/one.md')])
+        self.assertEqual(pages, set(['three.html']))
+        self.assertEqual(set(self.g.book), set(['two.html', 'three.html']))
+
+    def test_retitled_chapter_replaces_its_book_entry(self):
+        self.write('markdown/one.md', '---\ntitle: Prologue\n---\nfirst')
+        pages = self.g.rebuild([self.path('markdown/one.md')])
+        self.assertEqual(pages, set(['prologue.html']))
+        self.assertEqual(set(self.g.book), set(['prologue.html', 'two.html']))
+
+    def test_failed_rebuild_keeps_the_page_in_the_book(self):
+        self.write('markdown/one.md', 'first chapter\n$$ nosuchcmd')
+        with self.assertRaises(AttributeError):
+            self.g.rebuild([self.path('markdown/one.md')])
+        self.assertEqual(set(self.g.book), set(['one.html', 'two.html']))
+
+
+class IncrementalUnicodeTest(BookTestCase):
+
+    def test_non_ascii_file_names_and_titles(self):
+        self.write('markdown/café.md', 'un café')
+        self.write('markdown/one.md', '---\ntitle: Élan\n---\nfirst chapter')
+        self.build(INCREMENTAL=True)
+        g = self.build(INCREMENTAL=True)
+        self.assertEqual(g._unchanged, set(['café.md', 'one.md', 'two.md']))
+        self.assertTrue(all(isinstance(k, str) for k in g.book 
+                            if k!='elan.html'))
+
+
+class NavigationTest(BookTestCase):
+
+    def setUp(self):
+        super(NavigationTest, self).setUp()
+        self.write('markdown/toc.md', 
+                   '---\npage_level: 0\n---\nOne\n    Part\nTwo')
+        self.write('templates/nav.html', '{% for e in toc.entries %}'
+                   '<a href="{{ e.url }}"{{ active(e) }}>{{ e.title }}</a>'
+                   '{% endfor %}')
+        self.write('templates/main.html', '{{ data.nav }}|'
+                   '{% for e in data.breadcrumbs %}{{ e.title }}/{% endfor %}|'
+                   '{{ data.prev.url }}|{{ data.next.url }}')
+
+    def test_shared_nav_rendered_once_with_active_entries(self):
+        with mock.patch.object(Generator, '_navigation', autospec=True,
+                               side_effect=Generator._navigation) as mk_nav:
+            g = self.build(TOC_FILE='toc.md', NAV_TEMPLATE='nav.html')
+        self.assertEqual(self.read('website/one.html'), 
+                         '<a href="one.html" class="active">One</a>'
+                         '<a href="one.html" class="active">Part</a>'
+                         '<a href="two.html">Two</a>|One/||two.html')
+        self.assertEqual(self.read('website/two.html'), 
+                         '<a href="one.html">One</a>'
+                         '<a href="one.html">Part</a>'
+                         '<a href="two.html" class="active">Two</a>'
+                         '|Two/|one.html|')
+        # the nav template itself is only rendered once
+        self.assertEqual(mk_nav.call_count, 2)
+        self.assertEqual(g._nav[0], g.toc)
+        self.assertTrue('nav' not in g.book['one.html'])
+
+    def test_pages_using_navigation_depend_on_toc(self):
+        g = self.build(TOC_FILE='toc.md', NAV_TEMPLATE='nav.html', 
+                       track_dependencies=True)
+        self.assertEqual(
+            g.affected_outputs(os.path.join(self.root, 'templates/nav.html')),
+            g.affected_outputs(os.path.join(self.root, 'markdown/toc.md')))
+        self.assertEqual(len(g.affected_outputs(
+            os.path.join(self.root, 'markdown/toc.md'))), 2)
+
+
+class WriteOutputTest(BookTestCase):
+
+    def test_unchanged_outputs_are_not_rewritten(self):
+        self.build()
+        page = os.path.join(self.config['WEB_PAGES_PATH'], 'one.html')
+        os.utime(page, (1, 1))
+        g = self.build()
+        self.assertEqual(os.stat(page).st_mtime, 1)
+        self.assertEqual(g.write_stats, {'written': 0, 'skipped': 4})
+
+    def test_changed_outputs_are_rewritten(self):
+        self.build()
+        self.write('markdown/two.md', 'second chapter, fixed')
+        g = self.build()
+        self.assertEqual(g.write_stats, {'written': 2, 'skipped': 2})
+        self.assertEqual(self.read('website/two.html'), 
+                         '<main><p>second chapter, fixed</p></main>')
+
+    def test_same_size_outputs_are_compared(self):
+        self.build()
+        self.write('markdown/two.md', 'second chapteR')
+        g = self.build()
+        self.assertEqual(self.read('website/two.html'), 
+                         '<main><p>second chapteR</p></main>')
+
+    def test_failed_write_leaves_output_and_no_temporary_file(self):
+        self.build()
+        g = Generator(self.config)
+        page = os.path.join(self.config['WEB_PAGES_PATH'], 'one.html')
+        with mock.patch('os.rename', side_effect=OSError('disk full')):
+            with self.assertRaises(OSError):
+                g.write_output(page, 'something else')
+        self.assertEqual(self.read('website/one.html'), 
+                         '<main><p>first chapter</p></main>')
+        self.assertEqual(sorted(os.listdir(self.config['WEB_PAGES_PATH'])), 
+                         ['one.html', 'two.html'])
+
+    def test_outputs_get_the_permissions_of_open(self):
+        self.build()
+        mode = os.stat(os.path.join(self.config['WEB_PAGES_PATH'], 
+                                    'one.html')).st_mode
+        umask = os.umask(0)
+        os.umask(umask)
+        self.assertEqual(mode & 0o777, 0o666 & ~umask)
+
+
+class PartialSyncTest(BookTestCase):
+
+    def setUp(self):
+        super(PartialSyncTest, self).setUp()
+        self.write('markdown/partials/chart.html', '<svg></svg>')
+        self.write('markdown/one.md', 'first\n$$ include chart.html')
+        self.write('markdown/two.md', 'second\n$$ include chart.html')
+        self.partial = os.path.join(self.config['TEMPLATE_PATH'], 'partials',
+                                    'chart.html')
+
+    def test_partial_is_copied_once_per_build(self):
+        with mock.patch('tsk.generator.sync_file', 
+                        side_effect=tsk.utils.sync_file) as mk_sync:
+            g = self.build()
+        self.assertEqual(mk_sync.call_count, 1)
+        self.assertEqual(self.read('website/two.html'), 
+                         '<main><p>second\n<svg></svg></p></main>')
+        # every page still depends on it
+        for page in g.book.itervalues():
+            self.assertEqual(len(page['dependencies']), 1)
+
+    def test_unchanged_partial_is_not_copied_again(self):
+        self.build()
+        with mock.patch('shutil.copy2') as mk_copy:
+            self.build()
+        self.assertFalse(mk_copy.called)
+        self.write('markdown/partials/chart.html', '<svg>changed</svg>')
+        self.build()
+        self.assertEqual(self.read('templates/partials/chart.html'), 
+                         '<svg>changed</svg>')
+
+    def test_partials_can_be_hardlinked(self):
+        self.build(LINK_PARTIALS=True)
+        source = os.path.join(self.root, 'markdown', 'partials', 'chart.html')
+        self.assertTrue(os.path.samefile(source, self.partial))
+
+    def test_missing_partial_is_a_placeholder(self):
+        self.write('markdown/one.md', 'first\n$$ include missing.html')
+        self.build()
+        self.assertEqual(self.read('website/one.html'), 
+                         '<main><p>first\n[ ... ]</p></main>')
+
+    def test_copy_errors_are_not_hidden(self):
+        with mock.patch('shutil.copy2', side_effect=IOError('disk full')):
+            with self.assertRaises(IOError):
+                self.build()
+
+
+class MemoizedCommandTest(BookTestCase):
+
+    def setUp(self):
+        super(MemoizedCommandTest, self).setUp()
+        self.calls = calls = []
+        @memoized_command(files=lambda self, name: [
+            os.path.join(self.MARKDOWN_PATH, 'data', name)])
+        @bound_command
+        def tsk_command_table(self, name):
+            calls.append(name)
+            with open(os.path.join(self.MARKDOWN_PATH, 'data', name)) as f:
+                return '<table>{}</table>'.format(f.read())
+        self.command = tsk_command_table
+        self.write('markdown/data/t.csv', 'a,b')
+        self.write('markdown/one.md', 'first\n$$ table t.csv')
+        self.write('markdown/two.md', 'second\n$$ table t.csv')
+
+    def build(self, generator=None, **config):
+        g = generator or Generator(dict(self.config, **config))
+        if generator is None:
+            g.register_command(self.command)
+        g.build()
+        return g
+
+    def test_command_runs_once_for_the_same_arguments(self):
+        g = self.build()
+        self.assertEqual(self.calls, ['t.csv'])
+        self.assertEqual(self.read('website/two.html'), 
+                         '<main><p>second\n<table>a,b</table></p></main>')
+        # dependencies are recorded on hits as well
+        self.assertEqual(g.book['two.html']['dependencies'], 
+                         [os.path.join(self.root, 'markdown', 'data', 't.csv')])
+
+    def test_changed_files_invalidate_results(self):
+        g = self.build()
+        self.write('markdown/data/t.csv', 'a,b,c')
+        self.build(g)
+        self.assertEqual(self.calls, ['t.csv', 't.csv'])
+        self.assertEqual(self.read('website/one.html'), 
+                         '<main><p>first\n<table>a,b,c</table></p></main>')
+
+    def test_results_are_kept_in_command_cache_file(self):
+        path = os.path.join(self.root, 'commands.json')
+        self.build(COMMAND_CACHE_FILE=path)
+        self.build(COMMAND_CACHE_FILE=path)
+        self.assertEqual(self.calls, ['t.csv'])
+
+    def test_results_of_pool_workers_are_kept(self):
+        path = os.path.join(self.root, 'commands.json')
+        self.write('markdown/two.md', 'second\n$$ table u.csv')
+        self.write('markdown/data/u.csv', 'c')
+        self.build(COMMAND_CACHE_FILE=path, JOBS=2)
+        g = Generator(dict(self.config, COMMAND_CACHE_FILE=path))
+        self.assertEqual(len(g.command_cache.entries), 2)
+
+
+class ConcurrentCommandTest(BookTestCase):
+
+    def setUp(self):
+        super(ConcurrentCommandTest, self).setUp()
+        @concurrent_command
+        def tsk_command_slow(name, delay):
+            time.sleep(float(delay))
+            return '<{}>'.format(name)
+        self.command = tsk_command_slow
+        self.generator = Generator(self.config)
+        self.generator.register_command(tsk_command_slow)
+
+    def test_commands_of_a_file_run_concurrently(self):
+        text = '\n'.join('$$ slow c{} 0.1'.format(i) for i in xrange(4))
+        start = time.time()
+        meta, md = self.generator.preprocess_markdown('a\n' + text + '\nb')
+        self.assertTrue(time.time() - start < 0.3)
+        self.assertEqual(md, 'a\n<c0><c1><c2><c3>b')
+
+    def test_concurrency_is_limited(self):
+        self.generator.COMMAND_THREADS = 1
+        text = '\n'.join('$$ slow c{} 0.05'.format(i) for i in xrange(4))
+        start = time.time()
+        self.generator.preprocess_markdown(text)
+        self.assertTrue(time.time() - start >= 0.2)
+
+    def test_timeout_raises(self):
+        self.generator.COMMAND_TIMEOUT = 0.05
+        with self.assertRaises(TskError):
+            self.generator.preprocess_markdown('$$ slow c 0.5')
+
+    def test_errors_are_raised(self):
+        with self.assertRaises(ValueError):
+            self.generator.preprocess_markdown('$$ slow c not-a-number')
+
+    def test_direct_calls_run_synchronously(self):
+        self.assertEqual(self.generator.exec_command('slow', ['c', '0']), 
+                         '<c>')
+
+    def test_dependencies_of_memoized_concurrent_commands(self):
+        data = os.path.join(self.root, 'data')
+        @concurrent_command
+        @memoized_command
+        def tsk_command_read(name):
+            path = os.path.join(data, name)
+            self.generator.add_dependency(path)
+            return name
+        self.generator.register_command(tsk_command_read)
+        meta, md = self.generator.preprocess_markdown(
+            '$$ read a\n$$ read b\n$$ read a')
+        self.assertEqual(md, 'aba')
+        self.assertEqual(meta['dependencies'], 
+                         [os.path.join(data, 'a'), os.path.join(data, 'b')])
+        entries = self.generator.command_cache.entries
+        self.assertEqual(sorted(read[0][0] for result, read in 
+                                entries.values()), 
+                         [os.path.join(data, 'a'), os.path.join(data, 'b')])
+
+    def test_commands_run_in_pool_workers(self):
+        self.write('markdown/one.md', 'first\n$$ slow c 0')
+        g = self.generator
+        # threads started here are gone in forked workers
+        g.preprocess_markdown('$$ slow c 0')
+        g.build(jobs=2)
+        self.assertEqual(self.read('website/one.html'), 
+                         '<main><p>first\n<c></p></main>')
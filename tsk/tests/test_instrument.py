@@ -0,0 +1,69 @@
+# coding=utf8
+import os
+import json
+import time
+import unittest
+import mock
+
+from tsk.generator import Generator, tsk_command_include
+from tsk.instrument import BuildProfile
+from tsk.tests.test_generator import BookTestCase
+
+class BuildProfileTest(BookTestCase):
+
+    def setUp(self):
+        super(BuildProfileTest, self).setUp()
+        self.write('markdown/toc.md', '- [One](one.html)\n- [Two](two.html)')
+        self.write('markdown/partials/part.md', 'partial')
+        self.write('markdown/two.md', 'second chapter\n$$include part.md')
+        self.generator = Generator(dict(self.config, TOC_FILE='toc.md'))
+        self.generator.register_command(tsk_command_include)
+
+    def test_phases_are_timed(self):
+        profile = BuildProfile(self.generator)
+        self.generator.build()
+        for phase in ['preprocess', 'commands', 'markdown', 'toc', 'jinja',
+                      'write']:
+            self.assertIn(phase, profile.phases)
+        self.assertEqual(profile.phases['markdown']['calls'], 2)
+        self.assertEqual(profile.phases['toc']['calls'], 1)
+        self.assertEqual(profile.commands['include']['calls'], 1)
+        self.assertTrue(profile.total > 0)
+
+    def test_nested_phases_are_not_counted_twice(self):
+        profile = BuildProfile(self.generator)
+        command = self.generator.tsk_command_include
+        def slow_include(item):
+            time.sleep(0.05)
+            return command(item)
+        self.generator.tsk_command_include = slow_include
+        self.generator.build()
+        self.assertTrue(profile.phases['commands']['time'] >= 0.05)
+        self.assertTrue(profile.phases['preprocess']['time'] < 0.05)
+
+    def test_pages_include_markdown_and_web_page(self):
+        profile = BuildProfile(self.generator)
+        self.generator.build()
+        self.assertEqual(profile.pages['one.html']['calls'], 2)
+        times = [t for page, t in profile.slowest()]
+        self.assertEqual(len(times), 2)
+        self.assertEqual(times, sorted(times, reverse=True))
+
+    def test_report_is_saved_as_json(self):
+        profile = BuildProfile(self.generator)
+        self.generator.build()
+        path = os.path.join(self.root, 'profile.json')
+        profile.save(path)
+        with open(path) as f:
+            report = json.load(f)
+        self.assertEqual(set(report),
+                         set(['total', 'phases', 'commands', 'pages',
+                              'slowest']))
+        self.assertIn('peak_memory', report['phases']['markdown'])
+        self.assertIn('one.html', profile.summary())
+
+    def test_methods_are_only_wrapped_on_the_profiled_instance(self):
+        BuildProfile(self.generator)
+        self.assertIn('render_markdown', vars(self.generator))
+        other = Generator(self.config)
+        self.assertNotIn('render_markdown', vars(other))
@@ -0,0 +1,76 @@
+# coding=utf8
+import os
+import json
+import unittest
+import mock
+
+from tsk.search import SearchIndex, tokenize
+from tsk.tests.test_generator import BookTestCase
+
+class TokenizeTest(unittest.TestCase):
+
+    def test_text_is_taken_out_of_markup(self):
+        html = ("<h1>Été &amp; Hiver</h1>{% include 'partials/chart.html' %}"
+                "<p>hiver, a 2</p>")
+        self.assertEqual(tokenize(html), {u'été': 1, u'hiver': 2, u'2': 1})
+
+
+class SearchIndexTest(BookTestCase):
+
+    def setUp(self):
+        super(SearchIndexTest, self).setUp()
+        self.write('markdown/toc.md', 
+                   'Book\n    One\n        Alpha\n    Two')
+        self.write('markdown/one.md', 'first chapter about apples')
+        self.write('markdown/two.md', 
+                   '---\ntitle: Two\n---\nsecond chapter about pears')
+        self.config.update(TOC_FILE='toc.md', SEARCH_INDEX_DIR='search')
+
+    def read_json(self, path):
+        return json.loads(self.read(os.path.join('website', 'search', path)))
+
+    def lookup(self, term):
+        docs = self.read_json('docs.json')['docs']
+        try:
+            terms = self.read_json('terms/{}.json'.format(term[:2]))
+        except IOError:
+            return []
+        return sorted(docs[str(i)]['url'] for i, count in terms.get(term, []))
+
+    def test_pages_are_indexed(self):
+        self.build()
+        self.assertEqual(self.lookup('chapter'), ['one.html', 'two.html'])
+        self.assertEqual(self.lookup('apples'), ['one.html'])
+        docs = self.read_json('docs.json')['docs'].values()
+        one = [d for d in docs if d['url']=='one.html'][0]
+        self.assertEqual(one, {'url': 'one.html', 'title': 'One', 
+                               'path': ['Book'], 'sections': ['Alpha']})
+
+    def test_only_shards_of_changed_pages_are_written(self):
+        self.build(INCREMENTAL=True)
+        self.write('markdown/one.md', 'first chapter about plums')
+        with mock.patch.object(SearchIndex, '_save_shard', autospec=True,
+                               side_effect=SearchIndex._save_shard) as mk:
+            self.build(INCREMENTAL=True)
+        self.assertEqual(sorted(c[0][1] for c in mk.call_args_list),
+                         ['ap', 'pl'])
+        self.assertEqual(self.lookup('apples'), [])
+        self.assertEqual(self.lookup('plums'), ['one.html'])
+        self.assertEqual(self.lookup('pears'), ['two.html'])
+        self.assertFalse(os.path.exists(os.path.join(
+            self.root, 'website', 'search', 'terms', 'ap.json')))
+
+    def test_removed_pages_leave_the_index(self):
+        self.build()
+        os.remove(os.path.join(self.root, 'markdown', 'two.md'))
+        self.build()
+        self.assertEqual(self.lookup('chapter'), ['one.html'])
+        self.assertEqual(self.lookup('pears'), [])
+
+    def test_index_is_rebuilt_without_its_state(self):
+        self.build()
+        os.remove(os.path.join(self.root, 'templates', '.tsk-search.json'))
+        self.write('markdown/two.md', 'second chapter about figs')
+        self.build()
+        self.assertEqual(self.lookup('chapter'), ['one.html', 'two.html'])
+        self.assertEqual(self.lookup('pears'), [])
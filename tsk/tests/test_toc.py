@@ -89,3 +89,78 @@ Chapter 2
     # test for toc comments
     # test slugify replaces ampersand with `and`
     # test children
+
+
+class TOCPagesTest(unittest.TestCase):
+
+    @mock.patch('__builtin__.open')
+    def _toc(self, mk_open, pages=None):
+        mk_open.return_value.__enter__.return_value = StringIO.StringIO(
+            'Chapter 1\n    sublevel 1.1\nChapter 2')
+        return TOC(None, 'pages', pages)
+
+    @mock.patch('tsk.toc.os.path.isfile')
+    @mock.patch('tsk.toc.os.listdir')
+    def test_known_pages_need_no_filesystem_access(self, mk_listdir, 
+                                                   mk_isfile):
+        toc = self._toc(pages=set(['chapter-1.html']))
+        toc.generate()
+        self.assertFalse(mk_listdir.called or mk_isfile.called)
+        self.assertEqual(toc(0)['url'], 'chapter-1.html')
+        self.assertTrue(toc(1)['url'] is None)
+
+    @mock.patch('tsk.toc.os.path.isfile')
+    @mock.patch('tsk.toc.os.listdir')
+    def test_page_dir_listed_once(self, mk_listdir, mk_isfile):
+        mk_listdir.return_value = ['chapter-2.html', 'sublevel-1-1.html']
+        toc = self._toc()
+        toc.generate()
+        mk_listdir.assert_called_once_with('pages')
+        self.assertFalse(mk_isfile.called)
+        self.assertTrue(toc(0)['url'] is None)
+        self.assertEqual(toc(0, 0)['url'], 'sublevel-1-1.html')
+        self.assertEqual(toc(1)['url'], 'chapter-2.html')
+
+
+class TOCIndexTest(unittest.TestCase):
+
+    @mock.patch('__builtin__.open')
+    def setUp(self, mk_open):
+        mk_open.return_value.__enter__.return_value = StringIO.StringIO(
+            'Chapter 1\n    sublevel 1.1\n        sub 1.1.1\n'
+            'Chapter 2\n\tsublevel 2.1\nChapter 3')
+        self.toc = TOC(None, '', set(['chapter-1.html', 'chapter-2.html', 
+                                      'sublevel-2-1.html', 'chapter-3.html']))
+        self.toc.generate()
+
+    def test_flat_entries_in_toc_order(self):
+        entries = self.toc.entries
+        self.assertEqual([e['slug'] for e in entries], 
+                         ['chapter-1', 'sublevel-1-1', 'sub-1-1-1', 
+                          'chapter-2', 'sublevel-2-1', 'chapter-3'])
+        self.assertEqual([e['parent'] for e in entries], [-1, 0, 1, -1, 3, -1])
+        self.assertEqual([e['level'] for e in entries], [0, 1, 2, 0, 1, 0])
+        # same entries as the nested view
+        self.assertTrue(entries[4] is self.toc(1, 0))
+
+    def test_slug_and_url_indexes(self):
+        self.assertTrue(self.toc.entry('sub-1-1-1') is self.toc.entries[2])
+        self.assertEqual(self.toc.entries[2]['url'], None)
+        self.assertEqual([e['slug'] for e in self.toc.by_url['chapter-1.html']],
+                         ['chapter-1'])
+        self.assertTrue(self.toc.toc['by_slug'] is self.toc.by_slug)
+
+    def test_prev_and_next_pages(self):
+        self.assertEqual(self.toc.page_urls, ['chapter-1.html', 
+            'chapter-2.html', 'sublevel-2-1.html', 'chapter-3.html'])
+        self.assertTrue(self.toc.prev_page('chapter-1.html') is None)
+        self.assertEqual(self.toc.next_page('chapter-1.html')['slug'], 
+                         'chapter-2')
+        self.assertEqual(self.toc.prev_page('chapter-3.html')['slug'], 
+                         'sublevel-2-1')
+        self.assertTrue(self.toc.next_page('chapter-3.html') is None)
+
+    def test_breadcrumbs(self):
+        self.assertEqual([e['slug'] for e in 
+                          self.toc.breadcrumbs(self.toc.entries[2])],
+                         ['chapter-1', 'sublevel-1-1', 'sub-1-1-1'])
@@ -0,0 +1,126 @@
+# coding=utf8
+import os
+import time
+import shutil
+import tempfile
+import unittest 
+import mock
+
+from tsk import watch
+from tsk.watch import Watcher
+from tsk.generator import Generator
+from tsk.tests.test_generator import BookTestCase
+
+class WatcherTest(unittest.TestCase):
+
+    def setUp(self):
+        super(WatcherTest, self).setUp()
+        self.root = tempfile.mkdtemp()
+        self.generator = mock.Mock(
+            MARKDOWN_PATH=os.path.join(self.root, 'markdown'),
+            TEMPLATE_PATH=os.path.join(self.root, 'templates'),
+            MARKDOWN_OUTPUT_DIR=os.path.join(self.root, 'templates', 'pages'),
+            WEB_PAGES_PATH=os.path.join(self.root, 'website'),
+            JINJA_CACHE_DIR=None)
+        for d in ['markdown', 'templates/pages', 'website']:
+            os.makedirs(os.path.join(self.root, d))
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+        super(WatcherTest, self).tearDown()
+
+    def write(self, path, contents=''):
+        path = os.path.join(self.root, path)
+        with open(path, 'w') as f:
+            f.write(contents)
+        return path
+
+    def test_changes_between_snapshots(self):
+        previous = {'a.md': (1, 1.0), 'b.md': (1, 1.0), 'c.md': (1, 1.0)}
+        current = {'a.md': (1, 1.0), 'b.md': (2, 2.0), 'd.md': (1, 1.0)}
+        self.assertEqual(Watcher.changes(previous, current), 
+                         set(['b.md', 'c.md', 'd.md']))
+
+    def test_generated_and_hidden_files_are_ignored(self):
+        w = Watcher(self.generator)
+        path = lambda f: os.path.join(self.root, f)
+        self.assertTrue(w.ignored(path('templates/pages/a.html')))
+        self.assertTrue(w.ignored(path('markdown/.a.md.swp')))
+        self.assertFalse(w.ignored(path('templates/main.html')))
+
+    def test_only_copied_partials_are_ignored(self):
+        os.makedirs(os.path.join(self.root, 'markdown/partials'))
+        self.write('markdown/partials/chart.html')
+        w = Watcher(self.generator)
+        path = lambda f: os.path.join(self.root, f)
+        self.assertTrue(w.ignored(path('templates/partials/chart.html')))
+        self.assertFalse(w.ignored(path('templates/partials/nav.html')))
+
+    def test_rebuild_errors_are_reported_and_watching_goes_on(self):
+        w = Watcher(self.generator)
+        error = ValueError('bad command')
+        self.generator.rebuild.side_effect = [error, set(['a.html'])]
+        batches = [set(['a.md']), set(['a.md'])]
+        callback, errback = mock.Mock(), mock.Mock()
+        with mock.patch.object(w, 'start'), mock.patch.object(w, 'stop'), \
+                mock.patch.object(w, 'batches', return_value=batches):
+            w.run(callback, errback)
+        errback.assert_called_once_with(set(['a.md']), error)
+        callback.assert_called_once_with(set(['a.md']), set(['a.html']), 
+                                         mock.ANY)
+
+    @unittest.skipIf(watch.Observer is None, 'watchdog is not installed')
+    def test_filesystem_events_are_queued(self):
+        w = Watcher(self.generator)
+        handler = watch._EventHandler(w)
+        src = os.path.join(self.root, 'markdown/a.md')
+        dest = os.path.join(self.root, 'markdown/b.md')
+        handler.on_any_event(mock.Mock(is_directory=False, src_path=src, 
+                                       dest_path=dest))
+        handler.on_any_event(mock.Mock(is_directory=True, src_path=src))
+        self.assertEqual([w.events.get_nowait(), w.events.get_nowait()], 
+                         [src, dest])
+        self.assertTrue(w.events.empty())
+
+    def test_burst_of_changes_is_rebuilt_once(self):
+        w = Watcher(self.generator, debounce=0.2, poll_interval=0.01, 
+                    use_events=False)
+        w.start()
+        try:
+            a = self.write('markdown/a.md')
+            b = self.write('markdown/b.md')
+            self.write('templates/pages/a.html')
+            batch = next(w.batches())
+        finally:
+            w.stop()
+        self.assertEqual(batch, set([a, b]))
+
+
+class WatchBuildTest(BookTestCase):
+
+    def watch_edit(self, **kw):
+        g = Generator(self.config)
+        w = Watcher(g, **kw)
+        g.build()
+        w.start()
+        try:
+            start = time.time()
+            self.write('markdown/one.md', 'first chapter, fixed')
+            batch = next(w.batches())
+            pages = g.rebuild(batch)
+            elapsed = time.time() - start
+        finally:
+            w.stop()
+        self.assertEqual(pages, set(['one.html']))
+        self.assertEqual(self.read('website/one.html'), 
+                         '<main><p>first chapter, fixed</p></main>')
+        return elapsed
+
+    def test_edited_chapter_is_written_when_polling(self):
+        elapsed = self.watch_edit(use_events=False)
+        self.assertTrue(elapsed < 0.5, elapsed)
+
+    @unittest.skipIf(watch.Observer is None, 'watchdog is not installed')
+    def test_edited_chapter_is_written_within_100ms(self):
+        elapsed = self.watch_edit()
+        self.assertTrue(elapsed < 0.1, elapsed)
@@ -0,0 +1,78 @@
+# coding=utf8
+import os
+import time
+import threading
+import unittest
+import mock
+
+from tsk.writer import OutputWriter
+from tsk.generator import Generator
+from tsk.tests.test_generator import BookTestCase
+
+class OutputWriterTest(unittest.TestCase):
+
+    def test_flush_waits_for_every_write(self):
+        written = []
+        def write(path, data):
+            time.sleep(0.01)
+            written.append(path)
+        writer = OutputWriter(write, threads=2, queue_size=2)
+        for i in xrange(10):
+            writer.put(i, 'data')
+        writer.flush()
+        self.assertEqual(sorted(written), range(10))
+        writer.close()
+        self.assertFalse(any(t.is_alive() for t in writer.threads))
+
+    def test_queue_is_bounded(self):
+        release = threading.Event()
+        writer = OutputWriter(lambda path, data: release.wait(), threads=1,
+                              queue_size=1)
+        writer.put(1, 'data')
+        writer.put(2, 'data')
+        # one being written, one waiting: the next put blocks
+        blocked = threading.Thread(target=writer.put, args=(3, 'data'))
+        blocked.start()
+        blocked.join(0.05)
+        self.assertTrue(blocked.is_alive())
+        release.set()
+        blocked.join()
+        writer.close()
+
+    def test_first_error_is_raised_after_other_writes(self):
+        written = []
+        def write(path, data):
+            if path==1:
+                raise IOError('disk full')
+            written.append(path)
+        writer = OutputWriter(write, threads=1)
+        for i in xrange(4):
+            writer.put(i, 'data')
+        with self.assertRaises(IOError):
+            writer.close()
+        self.assertEqual(written, [0, 2, 3])
+
+
+class WriterBuildTest(BookTestCase):
+
+    def test_pages_are_written_in_the_background(self):
+        g = self.build(WRITER_THREADS=2)
+        self.assertEqual(self.read('website/two.html'), 
+                         '<main><p>second chapter</p></main>')
+        self.assertEqual(g.write_stats['written'], 4)
+        self.assertIsNone(g._writer)
+
+    def test_write_errors_are_raised_at_the_end(self):
+        write_output = Generator.write_output
+        def write(self, path, data):
+            if path.endswith('one.html') and 'website' in path:
+                raise IOError('disk full')
+            return write_output(self, path, data)
+        with mock.patch.object(Generator, 'write_output', write):
+            with self.assertRaises(IOError):
+                self.build(WRITER_THREADS=1, INCREMENTAL=True)
+        self.assertEqual(self.read('website/two.html'), 
+                         '<main><p>second chapter</p></main>')
+        # nothing was recorded
+        self.assertFalse(os.path.exists(os.path.join(
+            self.root, 'templates', '.tsk-manifest.json')))
@@ -9,14 +9,29 @@ class TOC(object):
     - navigation should be based on the presence of a file toc.toc
     - a mapping of the toc should be created with slugified titles as keys
     - if a file matching the key exists an url should be created
+
+    entries are kept both as a nested tree (`toc`) and as a flat list 
+    (`entries`) in toc order, where each entry knows its `index` and the 
+    index of its `parent` (-1 for top levels). `by_slug` and `by_url` index
+    that list for constant time lookups and prev/next navigation.
     """
 
-    def __init__(self, toc_file, page_dir):
+    # patterns used on every line
+    FIRST_CHAR = re.compile(r'[^\s\t]')
+
+    def __init__(self, toc_file, page_dir, pages=None):
         with open(toc_file) as f:
             self.toc_text = f.read()
         self.PAGE_DIR = page_dir
+        # output files known to exist, e.g. from the generator's book. 
+        # otherwise PAGE_DIR is listed once, on the first lookup.
+        self.pages = pages
         self.meta = {}
         self.toc = {}
+        self.entries = []
+        self.by_slug = {}
+        self.by_url = {}
+        self.page_urls = []
         self.set_default_meta(self.meta)
 
     def set_default_meta(self, meta):
@@ -25,8 +40,21 @@ class TOC(object):
         meta.setdefault('page_level', 1)
 
     def page_exists(self, slug):
-        filename = os.path.join(self.PAGE_DIR, slug+'.html')
-        return os.path.isfile(filename)
+        if self.pages is None:
+            self.pages = self.list_pages(self.PAGE_DIR)
+        return slug + '.html' in self.pages
+
+    @staticmethod
+    def list_pages(page_dir):
+        """
+        names of the files in `page_dir`, with a single directory scan.
+        """
+        try:
+            # only generated pages live there, names are enough and spare a
+            # stat per entry
+            return set(os.listdir(page_dir))
+        except OSError:
+            return set()
 
     def process_meta(self, line):
         # if in meta_mode we grab each key value pair
@@ -44,12 +72,12 @@ class TOC(object):
 
     def parse_line(self, line):
         space_indent = ' ' * self.meta['indent_spacing']
-        m = re.search(r'[^\s\t]', line)
+        m = self.FIRST_CHAR.search(line)
         text = line[m.start():] if m else line
         text = text.lstrip(self.meta['bullet_characters']).decode('utf8')
         indent = line[:m.start()] if m else ''
-        indent = re.sub(r'\t', space_indent, indent)
-        indent_level = len(re.findall(space_indent, indent))
+        indent = indent.replace('\t', space_indent)
+        indent_level = indent.count(space_indent)
         # new line with spaces instead of tabs at the beginning
         return indent_level, text
 
@@ -60,6 +88,11 @@ class TOC(object):
 
         self.toc = root_entry = dict(children=[], level=-1, title='', url='',
                                      hierarchy=hierarchy[:], slug='')
+        self.entries = []
+        self.by_slug = {}
+        self.by_url = {}
+        self.page_urls = []
+        self._page_positions = {}
         parent_entries = {root_entry['level']: root_entry}
         for line in self.toc_text.splitlines():
             if line.strip()=='-/-':
@@ -86,6 +119,10 @@ class TOC(object):
                 self.process_entry(entry, hierarchy, parent_entries)
 
         self.toc['page_level'] = self.meta['page_level']
+        # flat view and indexes, for templates
+        self.toc['entries'] = self.entries
+        self.toc['by_slug'] = self.by_slug
+        self.toc['by_url'] = self.by_url
 
     def process_entry(self, entry, hierarchy, parent_entries):
         def _set_hierarchy(entry, parent_entries, hierarchy):
@@ -123,6 +160,50 @@ class TOC(object):
         else:
             entry['url'] = parent_entry['url']
 
+        entry['index'] = len(self.entries)
+        entry['parent'] = parent_entry.get('index', -1)
+        self.entries.append(entry)
+        self.by_slug.setdefault(entry['slug'], entry)
+        if entry['url']:
+            if entry['url'] not in self.by_url:
+                self._page_positions[entry['url']] = len(self.page_urls)
+                self.page_urls.append(entry['url'])
+            self.by_url.setdefault(entry['url'], []).append(entry)
+
+    def entry(self, slug):
+        return self.by_slug.get(slug)
+
+    def page_entry(self, url):
+        """
+        the first entry pointing to page `url`.
+        """
+        entries = self.by_url.get(url)
+        return entries[0] if entries else None
+
+    def _adjacent_page(self, url, step):
+        position = self._page_positions.get(url)
+        if position is None:
+            return None
+        position += step
+        if 0 <= position < len(self.page_urls):
+            return self.page_entry(self.page_urls[position])
+        return None
+
+    def prev_page(self, url):
+        return self._adjacent_page(url, -1)
+
+    def next_page(self, url):
+        return self._adjacent_page(url, 1)
+
+    def breadcrumbs(self, entry):
+        """
+        entries from the top level down to `entry`.
+        """
+        rv = [entry]
+        while rv[0]['parent']!=-1:
+            rv.insert(0, self.entries[rv[0]['parent']])
+        return rv
+
     # TODO: TEST
     def children(self, *tree):
         children = self.toc['children']
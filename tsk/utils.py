@@ -1,13 +1,80 @@
 import os
 import re
-
-import slugify as _slugify
+import shutil
+import hashlib
+import importlib
 
 class TskError(Exception): pass
 
+class lazy_import(object):
+    """
+    module `name`, imported on first attribute access. keeps heavy 
+    dependencies out of the startup of builds that don't use them.
+    """
+    def __init__(self, name):
+        self.__name = name
+        self.__module = None
+
+    def __getattr__(self, attr):
+        if self.__module is None:
+            self.__module = importlib.import_module(self.__name)
+        return getattr(self.__module, attr)
+
+_slugify = lazy_import('slugify')
+
 def slugify(text):
     text = re.sub(r'&', 'and', text)
     return _slugify.slugify(text).lower()
 
 def basename_no_ext(file):
     return os.path.basename(os.path.splitext(file)[0])
+
+def file_hash(file, blocksize=65536):
+    """
+    sha1 hex digest of a file's contents, read in blocks.
+    """
+    h = hashlib.sha1()
+    with open(file, 'rb') as f:
+        for block in iter(lambda: f.read(blocksize), b''):
+            h.update(block)
+    return h.hexdigest()
+
+def file_stat(file):
+    """
+    (size, mtime) of a file or None if it's missing.
+    """
+    try:
+        st = os.stat(file)
+    except OSError:
+        return None
+    return [st.st_size, st.st_mtime]
+
+def sync_file(src, dst, link=False):
+    """
+    make `dst` a copy of `src` unless it already is one, with the same size
+    and mtime, or is `src` itself. with `link`, `dst` is hardlinked to `src`
+    where the filesystem allows it. returns whether `dst` was written.
+    """
+    st = os.stat(src)
+    try:
+        dst_st = os.stat(dst)
+    except OSError:
+        dst_st = None
+    if dst_st is not None:
+        if (st.st_dev, st.st_ino)==(dst_st.st_dev, dst_st.st_ino):
+            return False
+        # copies get their mtime back through utime, to the microsecond
+        if (st.st_size==dst_st.st_size and 
+                abs(st.st_mtime - dst_st.st_mtime) < 1e-5):
+            return False
+    if link:
+        try:
+            if dst_st is not None:
+                os.remove(dst)
+            os.link(src, dst)
+            return True
+        except OSError:
+            # across devices or not supported
+            pass
+    shutil.copy2(src, dst)
+    return True
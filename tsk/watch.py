@@ -0,0 +1,201 @@
+# coding=utf8
+"""
+rebuild the book as its sources change, with a generator kept warm in
+memory between changes.
+
+    python -m tsk.cli -c tskconfig.py watch
+
+filesystem events come from watchdog (inotify on linux), installed with
+`pip install tsk[watch]`, otherwise the watched directories are polled. 
+events arriving
+in a burst, e.g. an editor saving several files, are batched into a 
+single rebuild.
+"""
+import os
+import time
+import Queue
+import threading
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:
+    Observer = FileSystemEventHandler = None
+
+if FileSystemEventHandler is not None:
+    class _EventHandler(FileSystemEventHandler):
+        def __init__(self, watcher):
+            self.watcher = watcher
+
+        def on_any_event(self, event):
+            if event.is_directory:
+                return
+            self.watcher.notify(event.src_path)
+            if getattr(event, 'dest_path', None):
+                self.watcher.notify(event.dest_path)
+
+
+class Watcher(object):
+    """
+    watches MARKDOWN_PATH (chapters, partials and toc) and TEMPLATE_PATH, 
+    and hands each batch of modified files to `Generator.rebuild`.
+    """
+
+    # seconds without new events before a batch is rebuilt
+    DEBOUNCE = 0.03
+    # seconds between two scans when polling
+    POLL_INTERVAL = 0.05
+
+    def __init__(self, generator, debounce=None, poll_interval=None, 
+                 use_events=True):
+        self.generator = generator
+        # rebuilds rely on the dependency graph
+        generator.track_dependencies = True
+        if debounce is not None:
+            self.DEBOUNCE = debounce
+        if poll_interval is not None:
+            self.POLL_INTERVAL = poll_interval
+        self.use_events = use_events and Observer is not None
+        self.events = Queue.Queue()
+        self._stop = threading.Event()
+        self._observer = self._poller = None
+
+    def roots(self):
+        return [self.generator.MARKDOWN_PATH, self.generator.TEMPLATE_PATH]
+
+    def _generated(self):
+        g = self.generator
+        dirs = [g.MARKDOWN_OUTPUT_DIR, g.WEB_PAGES_PATH]
+        if g.JINJA_CACHE_DIR:
+            dirs.append(g.JINJA_CACHE_DIR)
+        return [os.path.normpath(d) + os.sep for d in dirs]
+
+    def _copied_partial(self, path):
+        """
+        whether `path` is a copy made by the include command of a partial
+        kept in MARKDOWN_PATH/partials. hand-written template partials are
+        watched like any other template.
+        """
+        g = self.generator
+        dirname, name = os.path.split(path)
+        if dirname!=os.path.normpath(os.path.join(g.TEMPLATE_PATH, 'partials')):
+            return False
+        return os.path.exists(os.path.join(g.MARKDOWN_PATH, 'partials', name))
+
+    def ignored(self, path):
+        """
+        files written by the build itself, hidden files and editor backups.
+        """
+        path = os.path.normpath(path)
+        name = os.path.basename(path)
+        if name.startswith('.') or name.endswith('~'):
+            return True
+        if self._copied_partial(path):
+            return True
+        return any(path.startswith(d) for d in self._generated())
+
+    def notify(self, path):
+        if not self.ignored(path):
+            self.events.put(os.path.normpath(path))
+
+    def snapshot(self):
+        """
+        size and mtime of every watched file.
+        """
+        rv = {}
+        generated = [d.rstrip(os.sep) for d in self._generated()]
+        for root in self.roots():
+            for dirpath, dirnames, filenames in os.walk(root):
+                dirnames[:] = [d for d in dirnames if os.path.normpath(
+                    os.path.join(dirpath, d)) not in generated]
+                for f in filenames:
+                    path = os.path.normpath(os.path.join(dirpath, f))
+                    if self.ignored(path):
+                        continue
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    rv[path] = st.st_size, st.st_mtime
+        return rv
+
+    @staticmethod
+    def changes(previous, current):
+        """
+        files created, modified or deleted between two snapshots.
+        """
+        changed = set(p for p, stat in current.iteritems() 
+                      if previous.get(p)!=stat)
+        changed.update(p for p in previous if p not in current)
+        return changed
+
+    def _poll(self, previous):
+        while not self._stop.wait(self.POLL_INTERVAL):
+            current = self.snapshot()
+            for path in self.changes(previous, current):
+                self.events.put(path)
+            previous = current
+
+    def start(self):
+        self._stop.clear()
+        if self.use_events:
+            self._observer = Observer()
+            handler = _EventHandler(self)
+            for root in self.roots():
+                self._observer.schedule(handler, root, recursive=True)
+            self._observer.start()
+        else:
+            self._poller = threading.Thread(target=self._poll, 
+                                            args=(self.snapshot(),))
+            self._poller.daemon = True
+            self._poller.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._observer:
+            self._observer.stop()
+            self._observer.join()
+        if self._poller:
+            self._poller.join()
+        self._observer = self._poller = None
+
+    def batches(self):
+        """
+        yield sets of modified files, once events stop for DEBOUNCE seconds.
+        """
+        while not self._stop.is_set():
+            try:
+                # a timeout keeps the wait interruptible
+                batch = set([self.events.get(timeout=0.5)])
+            except Queue.Empty:
+                continue
+            while True:
+                try:
+                    batch.add(self.events.get(timeout=self.DEBOUNCE))
+                except Queue.Empty:
+                    break
+            yield batch
+
+    def run(self, callback=None, errback=None):
+        """
+        rebuild on each batch of changes until interrupted. `callback` gets
+        the modified files, the pages generated and the seconds it took. 
+        errors are common while a file is being edited, e.g. a template 
+        syntax error or a misspelled command, they're passed to `errback` 
+        with the modified files and watching goes on.
+        """
+        self.start()
+        try:
+            for batch in self.batches():
+                start = time.time()
+                try:
+                    pages = self.generator.rebuild(batch)
+                except Exception as e:
+                    if errback is None:
+                        raise
+                    errback(batch, e)
+                    continue
+                if callback:
+                    callback(batch, pages, time.time() - start)
+        finally:
+            self.stop()
@@ -0,0 +1,63 @@
+# coding=utf8
+import sys
+import Queue
+import threading
+
+class OutputWriter(object):
+    """
+    writes outputs in `threads` background threads through `write(path,
+    data)` while the caller renders the next ones. at most `queue_size`
+    outputs wait to be written, `put` blocks beyond that.
+
+    errors don't stop the other writes, the first one is raised by `flush`
+    once every output queued is written.
+    """
+
+    def __init__(self, write, threads=2, queue_size=32):
+        self.write = write
+        self.queue = Queue.Queue(queue_size)
+        self.errors = []
+        self.threads = []
+        for i in xrange(threads):
+            t = threading.Thread(target=self._work, name='tsk-writer')
+            t.daemon = True
+            t.start()
+            self.threads.append(t)
+
+    def _work(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                try:
+                    self.write(*item)
+                except Exception:
+                    self.errors.append(sys.exc_info())
+            finally:
+                self.queue.task_done()
+
+    def put(self, path, data):
+        self.queue.put((path, data))
+
+    def flush(self):
+        """
+        wait for the outputs queued and raise the first error.
+        """
+        self.queue.join()
+        if self.errors:
+            errors, self.errors = self.errors, []
+            exc_type, exc_value, tb = errors[0]
+            raise exc_type, exc_value, tb
+
+    def close(self):
+        """
+        flush, then stop the threads.
+        """
+        try:
+            self.flush()
+        finally:
+            for t in self.threads:
+                self.queue.put(None)
+            for t in self.threads:
+                t.join()